@@ -0,0 +1,620 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import io
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import traceback
+import statistics
+import subprocess
+import tracemalloc
+import contextlib
+import xlsxwriter
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from colorama import init
+import remove_duplicates
+init()
+
+def menu():
+    parser = argparse.ArgumentParser(description = "Benchmark of remove_duplicates.py on synthetic exports, with a local stand-in for Crossref. Times each stage (load, DOI join, title resolution, complement, enrichment, write), records the peak memory and saves the results with the git commit, so runs can be compared across commits.", epilog = "Thank you!")
+    parser.add_argument("-s", "--sizes", default = ','.join([str(size) for size in bmk.SIZES]), help = "Unique records per repository, separated by comma (default: %s)" % ','.join([str(size) for size in bmk.SIZES]))
+    parser.add_argument("-r", "--repositories", type = int, default = bmk.REPOSITORIES, help = "Number of input files, from 2 to %s (default: %s)" % (len(bmk.REPOSITORY_FILES), bmk.REPOSITORIES))
+    parser.add_argument("--overlap", type = float, default = bmk.OVERLAP, help = "Fraction of the records of a repository also found in the others (default: %s)" % bmk.OVERLAP)
+    parser.add_argument("--title-collisions", type = float, default = bmk.TITLE_COLLISIONS, help = "Fraction of the records with the title of another record and a different DOI (default: %s)" % bmk.TITLE_COLLISIONS)
+    parser.add_argument("--doi-variants", type = float, default = bmk.DOI_VARIANTS, help = "Fraction of the DOIs written as 'https://doi.org/...', 'doi:...' or in uppercase (default: %s)" % bmk.DOI_VARIANTS)
+    parser.add_argument("--missing", type = float, default = bmk.MISSING, help = "Fraction of the records without abstract and language, filled from Crossref (default: %s)" % bmk.MISSING)
+    parser.add_argument("--latency", metavar = "SECONDS", type = float, default = bmk.LATENCY, help = "Latency of each request to the Crossref stand-in (default: %s)" % bmk.LATENCY)
+    parser.add_argument("--error-rate", type = float, default = bmk.ERROR_RATE, help = "Fraction of the requests answered with 503 by the Crossref stand-in (default: %s)" % bmk.ERROR_RATE)
+    parser.add_argument("--fuzzy-titles", metavar = "THRESHOLD", nargs = "?", type = float, const = bmk.FUZZY_THRESHOLD, help = "Run remove_duplicates.py with --fuzzy-titles, timed as its own stage (default threshold: %s)" % bmk.FUZZY_THRESHOLD)
+    parser.add_argument("--title-sizes", metavar = "SIZES", help = "Also time the fuzzy title grouping alone on this many titles, separated by comma, e.g. 10000,50000,200000")
+    parser.add_argument("--repeat", metavar = "N", type = int, default = bmk.REPEAT, help = "Runs of each size, the median time is kept (default: %s)" % bmk.REPEAT)
+    parser.add_argument("--seed", type = int, default = bmk.SEED, help = "Seed of the synthetic exports (default: %s)" % bmk.SEED)
+    parser.add_argument("--engine", choices = bmk.ENGINES, default = bmk.ENGINE, help = "Reader of the input files, auto uses calamine when installed and openpyxl otherwise (default: %s)" % bmk.ENGINE)
+    parser.add_argument("-j", "--jobs", metavar = "N", type = int, default = 1, help = "Processes parsing the input files, the memory of the workers is not measured (default: 1)")
+    parser.add_argument("--output-format", metavar = "FORMATS", default = 'xlsx', help = "Output formats of remove_duplicates.py (default: xlsx)")
+    parser.add_argument("--no-tracemalloc", action = "store_true", help = "Don't measure the peak memory of the stages, tracemalloc slows down the run")
+    parser.add_argument("-o", "--output", help = "Output folder of the results (default: benchmark_results)")
+    parser.add_argument("--compare", metavar = "FILE", help = "Results of another run to compare with")
+    parser.add_argument("--keep", metavar = "FOLDER", help = "Keep the synthetic exports and the outputs in this folder")
+
+    args = parser.parse_args()
+
+    bmk.SIZES = [int(size) for size in args.sizes.split(',') if size.strip()]
+    bmk.REPOSITORIES = min(max(2, args.repositories), len(bmk.REPOSITORY_FILES))
+    bmk.OVERLAP = args.overlap
+    bmk.TITLE_COLLISIONS = args.title_collisions
+    bmk.DOI_VARIANTS = args.doi_variants
+    bmk.MISSING = args.missing
+    bmk.LATENCY = args.latency
+    bmk.ERROR_RATE = args.error_rate
+    bmk.FUZZY_TITLES = args.fuzzy_titles
+    if args.title_sizes:
+        bmk.TITLE_SIZES = [int(size) for size in args.title_sizes.split(',') if size.strip()]
+    bmk.REPEAT = max(1, args.repeat)
+    bmk.SEED = args.seed
+    bmk.ENGINE = args.engine
+    bmk.JOBS = args.jobs
+    bmk.OUTPUT_FORMATS = [output_format.strip().lower() for output_format in args.output_format.split(',') if output_format.strip()]
+    bmk.TRACEMALLOC = not args.no_tracemalloc
+    bmk.COMPARE_FILE = args.compare
+    bmk.KEEP_PATH = args.keep
+
+    if args.output:
+        bmk.OUTPUT_PATH = args.output
+    bmk.OUTPUT_PATH = os.path.abspath(bmk.OUTPUT_PATH)
+    os.makedirs(bmk.OUTPUT_PATH, exist_ok = True)
+
+class MockCrossref:
+
+    def __init__(self, latency = 0, error_rate = 0, seed = 1, batch_misses = (), throttle_rate = 0, retry_after = 1, rate_limit = 1000, concurrency_limit = None):
+        # Crossref stand-in on a free local port. One DOI in three is unknown
+        # (404), always the same ones, like inactive DOIs. The batch_misses are
+        # known but left out of the multi-DOI answers. A fraction of the
+        # requests can fail (503) or be throttled (429 with Retry-After). The
+        # DOIs asked for are kept in requested
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after # Seconds
+        self.rate_limit = rate_limit # Requests per second
+        self.concurrency_limit = concurrency_limit
+        self.batch_misses = {doi.lower() for doi in batch_misses}
+        self.random = random.Random(seed)
+        self.stats = {'single': 0, 'batch': 0, 'errors': 0, 'throttled': 0}
+        self.requested = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.get_handler())
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, client_address: None # Clients hanging up on a timeout
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'single': 0, 'batch': 0, 'errors': 0, 'throttled': 0}
+            self.requested = []
+
+    def record(self, doi):
+        doi = doi.lower()
+        if zlib.crc32(doi.encode()) % 3 == 0:
+            return None
+
+        return {'DOI': doi,
+                'title': ['Title of %s' % doi],
+                'container-title': ['Journal of Synthetic Records'],
+                'abstract': '<jats:p>Abstract of <jats:italic>%s</jats:italic></jats:p>' % doi,
+                'created': {'date-parts': [[2000 + zlib.crc32(doi.encode()) % 25, 1, 1]]},
+                'is-referenced-by-count': zlib.crc32(doi.encode()) % 100,
+                'language': 'en',
+                'type': 'journal-article'}
+
+    def get_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, code, data, headers = None):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Rate-Limit-Limit', str(mock.rate_limit))
+                self.send_header('X-Rate-Limit-Interval', '1s')
+                if mock.concurrency_limit:
+                    self.send_header('X-Concurrency-Limit', str(mock.concurrency_limit))
+                for header, value in (headers or {}).items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                with mock.lock:
+                    failed = mock.random.random() < mock.error_rate
+                    throttled = not failed and mock.throttle_rate > 0 and mock.random.random() < mock.throttle_rate
+                    if failed:
+                        mock.stats['errors'] += 1
+                    if throttled:
+                        mock.stats['throttled'] += 1
+                if failed:
+                    return self.send(503, {'status': 'error'})
+                if throttled:
+                    return self.send(429, {'status': 'error'}, {'Retry-After': str(mock.retry_after)})
+
+                url = urlparse(self.path)
+                if url.path.startswith('/works/'):
+                    doi = unquote(url.path[len('/works/'):])
+                    with mock.lock:
+                        mock.stats['single'] += 1
+                        mock.requested.append(doi)
+                    record = mock.record(doi)
+                    if record is None:
+                        return self.send(404, {'status': 'error', 'message': 'Resource not found.'})
+                    return self.send(200, {'status': 'ok', 'message': record})
+
+                if url.path == '/works':
+                    query = parse_qs(url.query)
+                    dois = [value[len('doi:'):] for value in query.get('filter', [''])[0].split(',') if value.startswith('doi:')]
+                    with mock.lock:
+                        mock.stats['batch'] += 1
+                        mock.requested.extend(dois)
+                    fields = [field for field in query.get('select', [''])[0].split(',') if field]
+                    items = []
+                    for doi in dois:
+                        if doi.lower() in mock.batch_misses:
+                            continue
+                        record = mock.record(doi)
+                        if record:
+                            items.append({key: value for key, value in record.items() if not fields or key in fields})
+                    return self.send(200, {'status': 'ok', 'message': {'items': items, 'total-results': len(items)}})
+
+                self.send(404, {'status': 'error'})
+
+        return Handler
+
+class Benchmark:
+
+    def __init__(self):
+        self.VERSION = 1.0
+
+        # Synthetic exports
+        self.SIZES = [1000, 10000]
+        self.REPOSITORIES = 4
+        self.OVERLAP = 0.4
+        self.TITLE_COLLISIONS = 0.05
+        self.DOI_VARIANTS = 0.1
+        self.MISSING = 0.3
+        self.SEED = 1
+        self.WORDS = 5000
+
+        # Crossref stand-in
+        self.LATENCY = 0.01 # Seconds
+        self.ERROR_RATE = 0
+
+        # Fuzzy titles
+        self.FUZZY_TITLES = None
+        self.FUZZY_THRESHOLD = 0.85
+        self.TITLE_SIZES = []
+
+        # Runs
+        self.REPEAT = 3
+        self.ENGINE = 'auto'
+        self.ENGINES = ['auto', 'calamine', 'openpyxl']
+        self.JOBS = 1
+        self.OUTPUT_FORMATS = ['xlsx']
+        self.TRACEMALLOC = True
+        self.OUTPUT_PATH = 'benchmark_results'
+        self.COMPARE_FILE = None
+        self.KEEP_PATH = None
+        self.STAGES = ['load', 'fuzzy_titles', 'doi_join', 'title_resolution', 'complement', 'enrichment', 'write', 'total']
+
+        # Same order as get_list_files(), the base repository first
+        orr = remove_duplicates.RemoveDuplicate()
+        self.REPOSITORY_FILES = [orr.NAME_XLS_FILE_SCOPUS,
+                                 orr.NAME_XLS_FILE_WOS,
+                                 orr.NAME_XLS_FILE_PUBMED,
+                                 orr.NAME_XLS_FILE_PUBMED_CENTRAL,
+                                 orr.NAME_XLS_FILE_DIMENSIONS,
+                                 orr.NAME_XLS_FILE_GOOGLE_SCHOLAR,
+                                 orr.NAME_XLS_FILE_COCHRANE,
+                                 orr.NAME_XLS_FILE_EMBASE,
+                                 orr.NAME_XLS_FILE_SCIENCEDIRECT,
+                                 orr.NAME_XLS_FILE_IEEE,
+                                 orr.NAME_XLS_FILE_BVS,
+                                 orr.NAME_XLS_FILE_CAB,
+                                 orr.NAME_XLS_FILE_SCIELO]
+
+        # Fonts
+        self.RED = '\033[31m'
+        self.GREEN = '\033[32m'
+        self.YELLOW = '\033[33m'
+        self.BIGREEN = '\033[1;92m'
+        self.END = '\033[0m'
+
+    def show_print(self, message, showdate = True, font = None):
+        if font:
+            message = "%s%s%s" % (font, message, self.END)
+        if showdate is True:
+            message = "%s %s" % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
+        print(message)
+
+    def get_commit(self):
+        # Commit of remove_duplicates.py, '+' if it has local changes
+        path = os.path.dirname(os.path.abspath(remove_duplicates.__file__))
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = path, capture_output = True, text = True, check = True).stdout.strip()
+            changes = subprocess.run(['git', 'status', '--porcelain', '--', 'remove_duplicates.py'], cwd = path, capture_output = True, text = True, check = True).stdout.strip()
+            return '%s%s' % (commit, '+' if changes else '')
+        except Exception as e:
+            return 'unknown'
+
+    def get_title(self, rnd, words):
+        title = ' '.join([rnd.choice(words) for _ in range(rnd.randint(6, 16))])
+        return title[0].upper() + title[1:]
+
+    def get_doi_variant(self, rnd, doi):
+        variant = rnd.randint(0, 3)
+        if variant == 0:
+            return 'https://doi.org/%s' % doi
+        elif variant == 1:
+            return 'doi:%s' % doi
+        elif variant == 2:
+            return doi.upper()
+        return '%s.' % doi
+
+    def generate_exports(self, folder, size):
+        # Formatted exports of the repositories: 'Unique', 'Without DOI' and
+        # 'Duplicates' sheets, sharing a fraction of their records
+        rnd = random.Random('%s-%s' % (self.SEED, size))
+        words = [''.join([rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(3, 11))]) for _ in range(self.WORDS)]
+        orr = remove_duplicates.RemoveDuplicate()
+        columns = orr.xls_columns.copy()
+        columns.remove(orr.xls_col_repository)
+        document_types = ['Article', 'Review', 'Conference Paper', 'Book Chapter', 'Letter']
+
+        def get_work(doi):
+            return {orr.xls_col_title: self.get_title(rnd, words),
+                    orr.xls_col_abstract: 'Abstract %s' % ' '.join([rnd.choice(words) for _ in range(40)]),
+                    orr.xls_col_year: rnd.randint(1990, 2024),
+                    orr.xls_col_doi: doi,
+                    orr.xls_col_document_type: rnd.choice(document_types),
+                    orr.xls_col_languaje: 'English',
+                    orr.xls_col_cited_by: rnd.randint(0, 500),
+                    orr.xls_col_authors: '; '.join(['%s %s.' % (rnd.choice(words).title(), rnd.choice('ABCDEFGHIJ')) for _ in range(rnd.randint(1, 6))])}
+
+        shared = [get_work('10.5555/shared.%s' % i) for i in range(size)]
+        files = []
+        for index, name in enumerate(self.REPOSITORY_FILES[:self.REPOSITORIES]):
+            works = []
+            for i in range(size):
+                if rnd.random() < self.OVERLAP:
+                    work = rnd.choice(shared).copy()
+                else:
+                    work = get_work('10.5555/r%s.%s' % (index, i))
+                if rnd.random() < self.TITLE_COLLISIONS:
+                    work.update({orr.xls_col_title: rnd.choice(shared)[orr.xls_col_title]})
+                if rnd.random() < self.DOI_VARIANTS:
+                    work.update({orr.xls_col_doi: self.get_doi_variant(rnd, work[orr.xls_col_doi])})
+                if rnd.random() < self.MISSING:
+                    work.update({orr.xls_col_abstract: None, orr.xls_col_languaje: None})
+                works.append(work)
+
+            without_doi = []
+            for i in range(max(1, size // 20)):
+                work = get_work(None)
+                without_doi.append(work)
+
+            duplicates = []
+            for i in range(max(1, size // 10)):
+                work = rnd.choice(works).copy()
+                work.update({orr.xls_col_duplicate_type: orr.xls_val_by_doi})
+                duplicates.append(work)
+
+            file = os.path.join(folder, name)
+            workbook = xlsxwriter.Workbook(file, {'constant_memory': True})
+            for sheet, rows, sheet_columns in [(orr.XLS_SHEET_UNIQUE, works, columns),
+                                               (orr.XLS_SHEET_WITHOUT_DOI, without_doi, columns),
+                                               (orr.XLS_SHEET_DUPLICATES, duplicates, columns + [orr.xls_col_duplicate_type])]:
+                worksheet = workbook.add_worksheet(sheet)
+                worksheet.write_row(0, 0, sheet_columns)
+                for irow, row in enumerate(rows, start = 1):
+                    worksheet.write_row(irow, 0, [irow] + [row[column] for column in sheet_columns[1:]])
+            workbook.close()
+            files.append(file)
+
+        return files
+
+    @contextlib.contextmanager
+    def measure(self, timings, stage):
+        if self.TRACEMALLOC:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings.update({stage: {'seconds': time.perf_counter() - start,
+                                    'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20 if self.TRACEMALLOC else None}})
+
+    def run_pipeline(self, files, output_path, crossref):
+        # Same stages as main() of remove_duplicates.py, without the parse
+        # cache, the Crossref cache or the checkpoints
+        orr = remove_duplicates.RemoveDuplicate()
+        orr.OUTPUT_PATH = output_path
+        orr.XLS_FILE_OUTPUT = os.path.join(output_path, orr.XLS_FILE_OUTPUT)
+        orr.OUTPUT_FORMATS = self.OUTPUT_FORMATS
+        orr.XLS_ENGINE = self.ENGINE
+        orr.FUZZY_TITLES = self.FUZZY_TITLES
+        orr.LOG_FILE = None
+        orr.JOBS = self.JOBS
+        orr.PARSE_CACHE_PATH = None
+        orr.USE_CACHE = False
+        orr.CROSSREF_URL = crossref.url
+        for file in files:
+            for attribute in dir(orr):
+                if attribute.startswith('NAME_XLS_FILE_') and getattr(orr, attribute) == os.path.basename(file):
+                    setattr(orr, attribute[len('NAME_'):], file)
+
+        # Time spent in the title groups and the fuzzy titles, inside the merge
+        title_seconds = [0]
+        resolve_titles = orr.resolve_titles
+        def timed_resolve_titles(*args):
+            start = time.perf_counter()
+            resolve_titles(*args)
+            title_seconds[0] += time.perf_counter() - start
+        orr.resolve_titles = timed_resolve_titles
+
+        fuzzy_seconds = [0]
+        join_fuzzy_titles = orr.join_fuzzy_titles
+        def timed_join_fuzzy_titles(*args):
+            start = time.perf_counter()
+            join_fuzzy_titles(*args)
+            fuzzy_seconds[0] += time.perf_counter() - start
+        orr.join_fuzzy_titles = timed_join_fuzzy_titles
+
+        timings = {}
+        start = time.perf_counter()
+        if self.TRACEMALLOC:
+            tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                orr.open_crossref()
+                orr.get_list_files()
+                with self.measure(timings, 'load'):
+                    orr.load_xls_files()
+                with self.measure(timings, 'merge'):
+                    collect_unique, collect_duplicate = orr.get_sheet_data()
+                with self.measure(timings, 'complement'):
+                    collect_without_doi, collect_duplicates = orr.get_sheet_data_complement(collect_duplicate)
+                with self.measure(timings, 'enrichment'):
+                    orr.enrich_collection(collect_unique)
+                with self.measure(timings, 'write'):
+                    orr.save_summary(collect_unique, collect_without_doi, collect_duplicates)
+                orr.close_crossref()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20 if self.TRACEMALLOC else None
+        finally:
+            if self.TRACEMALLOC:
+                tracemalloc.stop()
+
+        merge = timings.pop('merge')
+        if self.FUZZY_TITLES:
+            timings.update({'fuzzy_titles': {'seconds': fuzzy_seconds[0], 'peak_mb': merge['peak_mb']}})
+        timings.update({'doi_join': {'seconds': merge['seconds'] - title_seconds[0] - fuzzy_seconds[0], 'peak_mb': merge['peak_mb']},
+                        'title_resolution': {'seconds': title_seconds[0], 'peak_mb': merge['peak_mb']},
+                        'total': {'seconds': time.perf_counter() - start, 'peak_mb': peak}})
+        counts = {'unique': len(collect_unique),
+                  'duplicates': len(collect_duplicates),
+                  'without_doi': len(collect_without_doi)}
+
+        return timings, counts
+
+    def run_size(self, folder, size, crossref):
+        input_path = os.path.join(folder, 'input_%s' % size)
+        os.makedirs(input_path, exist_ok = True)
+        self.show_print("Size %s: generating %s exports" % (size, self.REPOSITORIES))
+        files = self.generate_exports(input_path, size)
+
+        runs = []
+        for repeat in range(self.REPEAT):
+            crossref.reset()
+            output_path = os.path.join(folder, 'output_%s_%s' % (size, repeat + 1))
+            os.makedirs(output_path, exist_ok = True)
+            timings, counts = self.run_pipeline(files, output_path, crossref)
+            runs.append(timings)
+            self.show_print("  Run %s/%s: %.2fs" % (repeat + 1, self.REPEAT, timings['total']['seconds']))
+
+        stages = {}
+        for stage in [stage for stage in self.STAGES if stage in runs[0]]:
+            stages.update({stage: {'seconds': statistics.median([run[stage]['seconds'] for run in runs]),
+                                   'peak_mb': runs[0][stage]['peak_mb']}})
+
+        return {'size': size,
+                'records': size * self.REPOSITORIES,
+                'counts': counts,
+                'crossref_requests': dict(crossref.stats),
+                'stages': stages}
+
+    def generate_titles(self, size):
+        # Title keys, a third of them a variant of another title: other case
+        # and punctuation, a typo, a subtitle or another part number
+        rnd = random.Random('%s-titles-%s' % (self.SEED, size))
+        words = [''.join([rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(3, 11))]) for _ in range(self.WORDS)]
+        titles = []
+        for i in range(size):
+            if titles and rnd.random() < 0.33:
+                title = rnd.choice(titles)
+                variant = rnd.randint(0, 3)
+                if variant == 0:
+                    title = '%s.' % title.replace(' ', ', ', 1)
+                elif variant == 1:
+                    position = rnd.randint(0, len(title) - 2)
+                    title = title[:position] + title[position + 1] + title[position] + title[position + 2:]
+                elif variant == 2:
+                    title = '%s: %s' % (title, ' '.join([rnd.choice(words) for _ in range(rnd.randint(2, 5))]))
+                else:
+                    title = '%s part %s' % (title, rnd.randint(1, 5))
+            else:
+                title = self.get_title(rnd, words)
+            titles.append(title.lower())
+
+        return list(dict.fromkeys(titles))
+
+    def run_titles(self, size):
+        # get_fuzzy_title_keys() alone, without reading or merging the exports
+        self.show_print("Titles %s: grouping similar titles" % size)
+        title_keys = self.generate_titles(size)
+        orr = remove_duplicates.RemoveDuplicate()
+        orr.FUZZY_TITLES = self.FUZZY_TITLES or self.FUZZY_THRESHOLD
+
+        runs = []
+        for repeat in range(self.REPEAT):
+            timings = {}
+            if self.TRACEMALLOC:
+                tracemalloc.start()
+            try:
+                with self.measure(timings, 'fuzzy_titles'):
+                    fuzzy_keys = orr.get_fuzzy_title_keys(title_keys)
+            finally:
+                if self.TRACEMALLOC:
+                    tracemalloc.stop()
+            runs.append(timings['fuzzy_titles'])
+            self.show_print("  Run %s/%s: %.2fs" % (repeat + 1, self.REPEAT, timings['fuzzy_titles']['seconds']))
+
+        return {'size': size,
+                'titles': len(title_keys),
+                'groups': len(set(fuzzy_keys.values())),
+                'seconds': statistics.median([run['seconds'] for run in runs]),
+                'peak_mb': runs[0]['peak_mb']}
+
+    def get_parameters(self):
+        # The engine auto stands for the one installed
+        orr = remove_duplicates.RemoveDuplicate()
+        orr.XLS_ENGINE = self.ENGINE
+        return {'repositories': self.REPOSITORIES,
+                'overlap': self.OVERLAP,
+                'title_collisions': self.TITLE_COLLISIONS,
+                'doi_variants': self.DOI_VARIANTS,
+                'missing': self.MISSING,
+                'latency': self.LATENCY,
+                'error_rate': self.ERROR_RATE,
+                'fuzzy_titles': self.FUZZY_TITLES,
+                'repeat': self.REPEAT,
+                'seed': self.SEED,
+                'engine': orr.get_xls_engine(),
+                'jobs': self.JOBS,
+                'output_formats': self.OUTPUT_FORMATS,
+                'tracemalloc': self.TRACEMALLOC}
+
+    def show_results(self, results, previous = None):
+        # One line per size and stage: seconds, peak memory and the change
+        # against the previous results of the same size
+        previous_sizes = {result['size']: result for result in previous['results']} if previous else {}
+        self.show_print("")
+        self.show_print("%-8s %-17s %10s %10s %10s" % ('Size', 'Stage', 'Seconds', 'Peak MB', 'Change' if previous else ''), font = self.GREEN)
+        for result in results:
+            for stage in [stage for stage in self.STAGES if stage in result['stages']]:
+                seconds = result['stages'][stage]['seconds']
+                peak = result['stages'][stage]['peak_mb']
+                change = ''
+                font = None
+                if result['size'] in previous_sizes:
+                    before = previous_sizes[result['size']]['stages'].get(stage, {}).get('seconds')
+                    if before:
+                        ratio = seconds / before
+                        change = '%+.0f%%' % ((ratio - 1) * 100)
+                        font = self.RED if ratio > 1.1 else self.GREEN if ratio < 0.9 else None
+                self.show_print("%-8s %-17s %10.3f %10s %10s" % (result['size'], stage, seconds, '%.1f' % peak if peak is not None else '-', change), font = font)
+
+    def show_titles(self, titles, previous = None):
+        # One line per number of titles, against the previous results
+        previous_sizes = {result['size']: result for result in previous.get('titles', [])} if previous else {}
+        self.show_print("")
+        self.show_print("%-8s %-17s %10s %10s %10s" % ('Titles', 'Groups', 'Seconds', 'Peak MB', 'Change' if previous else ''), font = self.GREEN)
+        for result in titles:
+            change = ''
+            font = None
+            before = previous_sizes.get(result['size'], {}).get('seconds')
+            if before:
+                ratio = result['seconds'] / before
+                change = '%+.0f%%' % ((ratio - 1) * 100)
+                font = self.RED if ratio > 1.1 else self.GREEN if ratio < 0.9 else None
+            self.show_print("%-8s %-17s %10.3f %10s %10s" % (result['titles'], result['groups'], result['seconds'], '%.1f' % result['peak_mb'] if result['peak_mb'] is not None else '-', change), font = font)
+
+    def run(self):
+        folder = self.KEEP_PATH or tempfile.mkdtemp(prefix = 'remove_duplicates_benchmark_')
+        os.makedirs(folder, exist_ok = True)
+        crossref = MockCrossref(self.LATENCY, self.ERROR_RATE, self.SEED).start()
+        try:
+            results = [self.run_size(folder, size, crossref) for size in self.SIZES]
+            titles = [self.run_titles(size) for size in self.TITLE_SIZES]
+        finally:
+            crossref.stop()
+            if not self.KEEP_PATH:
+                shutil.rmtree(folder, ignore_errors = True)
+
+        commit = self.get_commit()
+        report = {'version': self.VERSION,
+                  'commit': commit,
+                  'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'cpus': os.cpu_count(),
+                  'parameters': self.get_parameters(),
+                  'results': results,
+                  'titles': titles}
+
+        file = os.path.join(self.OUTPUT_PATH, 'benchmark_%s_%s.json' % (commit, time.strftime('%Y%m%d_%H%M%S')))
+        with open(file, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+        previous = None
+        if self.COMPARE_FILE:
+            with open(self.COMPARE_FILE, 'r', encoding = 'utf-8') as f:
+                previous = json.load(f)
+            if previous['parameters'] != report['parameters']:
+                self.show_print("The results to compare with used other parameters", font = self.YELLOW)
+            self.show_print("Compared with commit %s" % previous['commit'])
+
+        self.show_results(results, previous)
+        if titles:
+            self.show_titles(titles, previous)
+        self.show_print("")
+        self.show_print("Results: %s" % file, font = self.GREEN)
+
+def main():
+    try:
+        start = time.time()
+        menu()
+        bmk.show_print("#############################################################################", font = bmk.BIGREEN)
+        bmk.show_print("################################# Benchmark #################################", font = bmk.BIGREEN)
+        bmk.show_print("#############################################################################", font = bmk.BIGREEN)
+        bmk.run()
+        bmk.show_print("Elapsed time: %s" % time.strftime("%H:%M:%S", time.gmtime(time.time() - start)))
+        bmk.show_print("Done!")
+    except Exception as e:
+        bmk.show_print("\n%s" % traceback.format_exc(), font = bmk.RED)
+
+if __name__ == '__main__':
+    bmk = Benchmark()
+    main()
@@ -1,27 +1,87 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
+import csv
+import json
 import time
+import pickle
+import random
+import html
+import cProfile
+import hashlib
+import operator
+import sqlite3
+import importlib.util
 import argparse
+import contextlib
+import uuid
+import queue
+import threading
+import multiprocessing
+import unicodedata
 import traceback
+import tracemalloc
+import requests
 import xlsxwriter
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from crossref.restful import Works
+from urllib.parse import quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, as_completed
 from colorama import init
 init()
 
+try:
+    import resource # Peak memory, not on Windows
+except ImportError:
+    resource = None
+
 def menu():
     parser = argparse.ArgumentParser(description = "This script eliminates the duplicated records from formatted .xlsx files from Scopus, Web of Science, PubMed, PubMed Central, Dimensions, Cochrane, Embase, ScienceDirect, IEEE, BVS, CAB, SciELO, or Google Scholar (Publish or Perish). Is mandatory that there be at least 2 different files from 2 different databases.", epilog = "Thank you!")
-    parser.add_argument("-f", "--files", required = True, help = ".xlsx files separated by comma")
+    parser.add_argument("-f", "--files", help = ".xlsx files separated by comma")
     parser.add_argument("-o", "--output", help = "Output folder")
+    parser.add_argument("--output-format", metavar = "FORMATS", default = ','.join(orr.OUTPUT_FORMATS), help = "Output formats separated by comma: %s (default: %s)" % (', '.join(orr.ALL_OUTPUT_FORMATS), ','.join(orr.OUTPUT_FORMATS)))
+    parser.add_argument("-j", "--jobs", metavar = "N", type = int, help = "Processes parsing the input files in parallel (default: number of CPUs)")
+    parser.add_argument("--engine", choices = orr.XLS_ENGINES, default = orr.XLS_ENGINE, help = "Reader of the input files, auto uses calamine when installed and openpyxl otherwise (default: %s)" % orr.XLS_ENGINE)
+    parser.add_argument("--parse-cache", metavar = "FOLDER", help = "Folder keeping the parsed input sheets, unchanged files are not parsed again (default: %s in the output folder)" % orr.NAME_PARSE_CACHE)
+    parser.add_argument("--no-parse-cache", action = "store_true", help = "Always parse the input files")
+    parser.add_argument("--fuzzy-titles", metavar = "THRESHOLD", nargs = "?", type = float, const = orr.FUZZY_THRESHOLD, help = "Also join titles that differ in punctuation, accents, HTML entities, small typos or a trailing subtitle, if their similarity is at least THRESHOLD (default: %s)" % orr.FUZZY_THRESHOLD)
+    parser.add_argument("--state", metavar = "FILE", help = "Dedup index of the project. It's saved after the run, and the next runs only merge the new input files into it. If a merged file was updated or removed, or a new one comes before it in the merge order, all the files are merged again")
+    parser.add_argument("--resume", action = "store_true", help = "Continue an interrupted run from its checkpoint in the output folder, without removing the duplicates again or repeating the Crossref lookups already done")
+    parser.add_argument("--concurrency", metavar = "N", type = int, default = orr.CROSSREF_WORKERS, help = "Maximum number of simultaneous Crossref requests (default: %s)" % orr.CROSSREF_WORKERS)
+    parser.add_argument("--batch-size", metavar = "N", type = int, default = orr.CROSSREF_BATCH_SIZE, help = "Number of DOIs per Crossref request (default: %s)" % orr.CROSSREF_BATCH_SIZE)
+    parser.add_argument("--crossref-url", metavar = "URL", default = orr.CROSSREF_URL, help = "Crossref REST API (default: %s)" % orr.CROSSREF_URL)
+    parser.add_argument("--pool-size", metavar = "N", type = int, help = "Keep-alive connections to Crossref (default: same as --concurrency)")
+    parser.add_argument("--timeout", metavar = "SECONDS", type = float, default = orr.CROSSREF_TIMEOUT, help = "Timeout of each Crossref request (default: %s)" % orr.CROSSREF_TIMEOUT)
+    parser.add_argument("--retries", metavar = "N", type = int, default = orr.CROSSREF_RETRIES, help = "Retries of a failed or throttled Crossref request, with exponential backoff (default: %s)" % orr.CROSSREF_RETRIES)
+    parser.add_argument("--circuit-breaker", metavar = "N", type = int, default = orr.CROSSREF_BREAKER_FAILURES, help = "Failed Crossref requests in a row after which Crossref is not called for %s seconds (default: %s)" % (orr.CROSSREF_BREAKER_COOLDOWN, orr.CROSSREF_BREAKER_FAILURES))
+    parser.add_argument("--mailto", metavar = "EMAIL", help = "Contact email sent to Crossref to use its polite pool")
+    parser.add_argument("--enrich-budget", metavar = "SECONDS", type = float, help = "Stop getting additional information from Crossref after this time, the most incomplete rows are filled first")
+    parser.add_argument("--enrich-max-requests", metavar = "N", type = int, help = "Maximum number of DOIs looked up in Crossref to fill the missing fields")
+    parser.add_argument("--cache", metavar = "FILE", help = "Crossref cache file (default: %s in the output folder)" % orr.NAME_CACHE_FILE)
+    parser.add_argument("--cache-ttl", metavar = "DAYS", type = float, default = orr.CACHE_TTL, help = "Days a cached Crossref record is valid, 0 to always fetch them again (default: %s)" % orr.CACHE_TTL)
+    parser.add_argument("--cache-max-entries", metavar = "N", type = int, default = orr.CACHE_MAX_ENTRIES, help = "Maximum number of DOIs kept in the Crossref cache (default: %s)" % orr.CACHE_MAX_ENTRIES)
+    parser.add_argument("--warm-cache", action = "store_true", help = "Fetch the Crossref records of all input DOIs into the cache before removing duplicates")
+    parser.add_argument("--no-cache", action = "store_true", help = "Don't read or write the Crossref cache")
+    parser.add_argument("--profile", action = "store_true", help = "Save a cProfile profile of the run in the output folder (.prof, for pstats, snakeviz or flameprof)")
+    parser.add_argument("--trace-memory", action = "store_true", help = "Measure the peak memory of each stage with tracemalloc, slower")
+    parser.add_argument("--serve", metavar = "ADDRESS", nargs = "?", type = orr.get_serve_address, const = (orr.SERVE_HOST, orr.SERVE_PORT), help = "Run as a local service taking jobs from remove_duplicates_client.py, with the Crossref client and cache kept warm. ADDRESS is HOST:PORT, PORT or HOST (default: %s:%s)" % (orr.SERVE_HOST, orr.SERVE_PORT))
+    parser.add_argument("--workers", metavar = "N", type = int, default = orr.SERVE_WORKERS, help = "Jobs run at the same time by the service (default: %s)" % orr.SERVE_WORKERS)
     parser.add_argument("--version", action = "version", version = "%s %s" % ('%(prog)s', orr.VERSION))
     args = parser.parse_args()
+    if not args.files and not args.serve:
+        parser.error("the following arguments are required: -f/--files")
+
+    if args.serve:
+        orr.SERVE = True
+        orr.SERVE_HOST, orr.SERVE_PORT = args.serve
+        orr.SERVE_WORKERS = args.workers
 
-    orr.INPUT_XLS_FILES = args.files
-    file_list = orr.INPUT_XLS_FILES.split(',')
+    orr.INPUT_XLS_FILES = args.files or ''
+    file_list = [file for file in orr.INPUT_XLS_FILES.split(',') if file]
     for file in file_list:
         file_name = os.path.basename(file)
         file_path = os.path.dirname(file)
@@ -34,32 +94,7 @@ def menu():
             orr.show_print("%s: error: the following arguments are required: -f/--files" % os.path.basename(__file__), showdate = False, font = orr.YELLOW)
             exit()
 
-        if os.path.basename(this_file) == orr.NAME_XLS_FILE_SCOPUS:
-            orr.XLS_FILE_SCOPUS = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_WOS:
-            orr.XLS_FILE_WOS = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_PUBMED:
-            orr.XLS_FILE_PUBMED = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_PUBMED_CENTRAL:
-            orr.XLS_FILE_PUBMED_CENTRAL = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_DIMENSIONS:
-            orr.XLS_FILE_DIMENSIONS = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_GOOGLE_SCHOLAR:
-            orr.XLS_FILE_GOOGLE_SCHOLAR = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_COCHRANE:
-            orr.XLS_FILE_COCHRANE = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_EMBASE:
-            orr.XLS_FILE_EMBASE = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_SCIENCEDIRECT:
-            orr.XLS_FILE_SCIENCEDIRECT = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_IEEE:
-            orr.XLS_FILE_IEEE = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_BVS:
-            orr.XLS_FILE_BVS = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_CAB:
-            orr.XLS_FILE_CAB = this_file
-        elif os.path.basename(this_file) == orr.NAME_XLS_FILE_SCIELO:
-            orr.XLS_FILE_SCIELO = this_file
+        orr.set_input_file(this_file)
 
     if args.output:
         output_name = os.path.basename(args.output)
@@ -77,19 +112,600 @@ def menu():
         orr.OUTPUT_PATH = os.path.join(orr.OUTPUT_PATH, 'output_remove_duplicate')
         orr.create_directory(orr.OUTPUT_PATH)
 
+    output_formats = [output_format.strip().lower() for output_format in args.output_format.split(',') if output_format.strip()]
+    for output_format in output_formats:
+        if output_format not in orr.ALL_OUTPUT_FORMATS:
+            orr.show_print("%s: error: unknown output format '%s', choose from: %s" % (os.path.basename(__file__), output_format, ', '.join(orr.ALL_OUTPUT_FORMATS)), showdate = False, font = orr.YELLOW)
+            exit()
+        if output_format == orr.FORMAT_PARQUET and not importlib.util.find_spec('pyarrow'):
+            orr.show_print("%s: error: the parquet output format requires pyarrow (pip3 install pyarrow)" % os.path.basename(__file__), showdate = False, font = orr.YELLOW)
+            exit()
+    orr.OUTPUT_FORMATS = list(dict.fromkeys(output_formats)) or [orr.FORMAT_XLSX]
+
+    if args.no_parse_cache:
+        orr.PARSE_CACHE_PATH = None
+    elif args.parse_cache:
+        parse_cache_name = os.path.basename(args.parse_cache)
+        parse_cache_path = os.path.dirname(args.parse_cache)
+        if parse_cache_path is None or parse_cache_path == "":
+            parse_cache_path = os.getcwd().strip()
+
+        orr.PARSE_CACHE_PATH = os.path.join(parse_cache_path, parse_cache_name)
+    else:
+        orr.PARSE_CACHE_PATH = os.path.join(orr.OUTPUT_PATH, orr.NAME_PARSE_CACHE)
+
+    if args.state:
+        state_name = os.path.basename(args.state)
+        state_path = os.path.dirname(args.state)
+        if state_path is None or state_path == "":
+            state_path = os.getcwd().strip()
+
+        orr.STATE_FILE = os.path.join(state_path, state_name)
+
+    if args.cache:
+        cache_name = os.path.basename(args.cache)
+        cache_path = os.path.dirname(args.cache)
+        if cache_path is None or cache_path == "":
+            cache_path = os.getcwd().strip()
+
+        orr.CACHE_FILE = os.path.join(cache_path, cache_name)
+
+    orr.JOBS = args.jobs
+    orr.XLS_ENGINE = args.engine
+    orr.CROSSREF_WORKERS = args.concurrency
+    orr.CROSSREF_BATCH_SIZE = args.batch_size
+    orr.CROSSREF_URL = args.crossref_url
+    orr.CROSSREF_POOL_SIZE = args.pool_size
+    orr.CROSSREF_TIMEOUT = args.timeout
+    orr.CROSSREF_MAILTO = args.mailto
+    orr.CROSSREF_RETRIES = max(0, args.retries)
+    orr.CROSSREF_BREAKER_FAILURES = max(1, args.circuit_breaker)
+    orr.ENRICH_BUDGET = args.enrich_budget
+    orr.ENRICH_MAX_REQUESTS = args.enrich_max_requests
+    orr.CACHE_TTL = max(0, args.cache_ttl)
+    orr.CACHE_MAX_ENTRIES = args.cache_max_entries
+    orr.WARM_CACHE = args.warm_cache
+    orr.FUZZY_TITLES = args.fuzzy_titles
+    orr.RESUME = args.resume
+    orr.TRACE_MEMORY = args.trace_memory
+    if args.profile:
+        orr.PROFILE_FILE = os.path.join(orr.OUTPUT_PATH, '%s_%s.prof' % (os.path.splitext(orr.LOG_NAME)[0], time.strftime('%H%M%S')))
+    orr.USE_CACHE = not args.no_cache
+
+class CrossrefUnavailable(Exception):
+    # Crossref didn't answer after the retries, or the circuit breaker is open.
+    # Unlike an unknown DOI, this says nothing about the DOI
+    pass
+
+class CrossrefClient:
+
+    def __init__(self, url = 'https://api.crossref.org', pool_size = 10, timeout = 30, mailto = None, user_agent = 'remove-duplicates', retries = 4, backoff = 1, breaker_failures = 5, breaker_cooldown = 60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout # Seconds, for connecting and for each read
+        self.retries = retries
+        self.backoff = backoff # Seconds, doubled on each retry
+        self.breaker_failures = breaker_failures # Failed requests in a row that open the breaker
+        self.breaker_cooldown = breaker_cooldown # Seconds before trying again
+
+        # Scheduler shared by the threads: spacing and number of the requests
+        # from the rate limit headers, and the state of the breaker
+        self.lock = threading.Condition()
+        self.interval = 0 # Seconds between requests
+        self.next_request = 0
+        self.concurrency = None
+        self.active = 0
+        self.failures = 0
+        self.open_until = 0
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'failed': 0}
+
+        # Keep-alive connections shared by all the requests of the run
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Polite pool: https://api.crossref.org/swagger-ui/index.html
+        if mailto:
+            user_agent = '%s (mailto:%s)' % (user_agent, mailto)
+            self.session.params = {'mailto': mailto}
+        self.session.headers.update({'User-Agent': user_agent})
+
+    def close(self):
+        self.session.close()
+
+    def acquire(self, stats = None):
+        with self.lock:
+            if time.time() < self.open_until:
+                raise CrossrefUnavailable('circuit breaker open')
+
+            while self.concurrency and self.active >= self.concurrency:
+                self.lock.wait()
+            self.active += 1
+
+            self.add_stats('requests', stats)
+            now = time.time()
+            wait = max(0, self.next_request - now)
+            self.next_request = max(now, self.next_request) + self.interval
+        time.sleep(wait)
+
+    def release(self, response = None, failed = False):
+        with self.lock:
+            self.active -= 1
+            if failed:
+                self.failures += 1
+                if self.failures >= self.breaker_failures:
+                    self.open_until = time.time() + self.breaker_cooldown
+            elif response is not None:
+                self.failures = 0
+                self.update_limits(response.headers)
+            self.lock.notify()
+
+    def count(self, name, stats = None, n = 1):
+        with self.lock:
+            self.add_stats(name, stats, n)
+
+    def add_stats(self, name, stats = None, n = 1):
+        # The client can be shared by several runs (the jobs of the service),
+        # each one counts its own requests in stats
+        self.stats.update({name: self.stats.get(name, 0) + n})
+        if stats is not None:
+            stats.update({name: stats.get(name, 0) + n})
+
+    def update_limits(self, headers):
+        # X-Rate-Limit-Limit: 50, X-Rate-Limit-Interval: 1s, X-Concurrency-Limit: 5
+        try:
+            limit = int(headers.get('X-Rate-Limit-Limit', 0))
+            interval = float(headers.get('X-Rate-Limit-Interval', '1s').rstrip('s'))
+            if limit > 0:
+                self.interval = interval / limit
+            if headers.get('X-Concurrency-Limit'):
+                self.concurrency = max(1, int(headers['X-Concurrency-Limit']))
+        except ValueError as e:
+            pass
+
+    def get(self, url, params = None, stats = None, lookups = None, deadline = None):
+        # GET with retries on timeouts, connection errors, 429 and 5xx, waiting
+        # Retry-After or an exponential backoff with jitter. The lookups
+        # ({counter: n}) are counted once, if a request is sent. Past the
+        # deadline nothing is tried again, and no attempt waits longer than
+        # the time left
+        for attempt in range(self.retries + 1):
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    raise CrossrefUnavailable('deadline passed: %s' % url)
+
+            self.acquire(stats)
+            if attempt == 0:
+                for name, n in (lookups or {}).items():
+                    self.count(name, stats, n)
+            response = None
+            try:
+                response = self.session.get(url, params = params, timeout = timeout)
+            except requests.exceptions.Timeout as e:
+                # Cut short by the deadline, not a failure of Crossref
+                self.release(failed = timeout == self.timeout)
+            except requests.exceptions.ConnectionError as e:
+                self.release(failed = True)
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    self.release(response)
+                    return response
+                self.release(failed = response.status_code >= 500)
+
+            if attempt == self.retries or time.time() < self.open_until:
+                break
+
+            delay = self.get_delay(attempt, response)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise CrossrefUnavailable('deadline passed: %s' % url)
+            self.count('retries', stats)
+            if response is not None and response.status_code == 429:
+                self.count('throttled', stats)
+            time.sleep(delay)
+
+        self.count('failed', stats)
+        raise CrossrefUnavailable(url)
+
+    def get_delay(self, attempt, response = None):
+        # Exponential backoff with jitter, between half and all of
+        # backoff * 2^attempt, or longer if a 429 asks for it in Retry-After
+        delay = self.backoff * 2 ** attempt
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if response is not None and response.status_code == 429:
+            try:
+                delay = max(delay, float(response.headers.get('Retry-After', 0)))
+            except ValueError as e:
+                pass
+
+        return delay
+
+    def work(self, doi, stats = None, deadline = None):
+        # Crossref record of a DOI, None if Crossref doesn't know it
+        response = self.get('%s/works/%s' % (self.url, quote(doi)), stats = stats, lookups = {'single_lookups': 1}, deadline = deadline)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+
+        return response.json()['message']
+
+    def works(self, dois, fields = None, stats = None, deadline = None):
+        # Crossref records of several DOIs in one request, {doi: record or None}.
+        # None only means the filter didn't return the DOI, not that Crossref
+        # doesn't know it. DOIs are matched in lowercase and must not contain commas
+        params = {'filter': ','.join(['doi:%s' % doi for doi in dois]), 'rows': len(dois)}
+        if fields:
+            params.update({'select': ','.join(fields)})
+
+        response = self.get('%s/works' % self.url, params = params, stats = stats, lookups = {'batch_lookups': 1, 'batch_dois': len(dois)}, deadline = deadline)
+        response.raise_for_status()
+
+        records = {doi.lower(): None for doi in dois}
+        for item in response.json()['message']['items']:
+            doi = item.get('DOI', '').lower()
+            if doi in records:
+                records.update({doi: item})
+
+        return records
+
+class XlsxSummaryWriter:
+
+    def __init__(self, path):
+        self.files = [path]
+        self.worksheet = None
+
+        # Rows are flushed to disk as they are written
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+
+        # Styles
+        self.cell_format_title = self.workbook.add_format({'bold': True,
+                                                           'font_color': 'white',
+                                                           'bg_color': 'black',
+                                                           'align': 'center',
+                                                           'valign': 'vcenter'})
+        self.cell_format_row = self.workbook.add_format({'text_wrap': True, 'valign': 'top'})
+
+        # Columns A:A to K:K
+        self.widths = [7, 30, 33, 8, 30, 18, 12, 11, 18, 13, 17]
+
+    def add_sheet(self, sheet_type, columns):
+        _last_col = len(columns) - 1
+
+        self.worksheet = self.workbook.add_worksheet(sheet_type)
+        self.worksheet.freeze_panes(row = 1, col = 0) # Freeze the first row.
+        self.worksheet.autofilter(first_row = 0, first_col = 0, last_row = 0, last_col = _last_col)
+        self.worksheet.set_default_row(height = 14.5)
+
+        # Add columns
+        self.worksheet.write_row(0, 0, columns, self.cell_format_title)
+        for icol, width in enumerate(self.widths[:len(columns)]):
+            self.worksheet.set_column(first_col = icol, last_col = icol, width = width)
+
+    def write_row(self, irow, row):
+        self.worksheet.write_row(irow, 0, row, self.cell_format_row)
+
+    def close(self):
+        self.workbook.close()
+
+class CsvSummaryWriter:
+
+    def __init__(self, base, extension, sheet_names):
+        self.base = base
+        self.extension = extension
+        self.delimiter = '\t' if extension == 'tsv' else ','
+        self.sheet_names = sheet_names
+        self.files = []
+        self.handle = None
+        self.writer = None
+
+    def add_sheet(self, sheet_type, columns):
+        self.close()
+        path = '%s_%s.%s' % (self.base, self.sheet_names[sheet_type], self.extension)
+        self.files.append(path)
+        self.handle = open(path, 'w', encoding = 'utf-8', newline = '')
+        self.writer = csv.writer(self.handle, delimiter = self.delimiter)
+        self.writer.writerow(columns)
+
+    def write_row(self, irow, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+class JsonlSummaryWriter:
+
+    def __init__(self, base, sheet_names):
+        self.base = base
+        self.sheet_names = sheet_names
+        self.files = []
+        self.handle = None
+        self.columns = None
+
+    def add_sheet(self, sheet_type, columns):
+        self.close()
+        path = '%s_%s.jsonl' % (self.base, self.sheet_names[sheet_type])
+        self.files.append(path)
+        self.handle = open(path, 'w', encoding = 'utf-8')
+        self.columns = columns
+
+    def write_row(self, irow, row):
+        self.handle.write('%s\n' % json.dumps(dict(zip(self.columns, row)), ensure_ascii = False, default = str))
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+class ParquetSummaryWriter:
+
+    def __init__(self, base, sheet_names, col_item, batch_size = 10000):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.base = base
+        self.sheet_names = sheet_names
+        self.col_item = col_item
+        self.batch_size = batch_size
+        self.files = []
+        self.writer = None
+        self.schema = None
+        self.rows = []
+
+    def add_sheet(self, sheet_type, columns):
+        self.close()
+        path = '%s_%s.parquet' % (self.base, self.sheet_names[sheet_type])
+        self.files.append(path)
+
+        # Exports mix numbers and text in the same column, so values are kept as text
+        fields = [(column, self.pa.int64() if column == self.col_item else self.pa.string()) for column in columns]
+        self.schema = self.pa.schema(fields)
+        self.writer = self.pq.ParquetWriter(path, self.schema)
+
+    def get_text(self, value):
+        if value is None:
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
+    def write_row(self, irow, row):
+        self.rows.append([row[0]] + [self.get_text(value) for value in row[1:]])
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            arrays = [list(column) for column in zip(*self.rows)]
+            self.writer.write_batch(self.pa.record_batch(arrays, schema = self.schema))
+            self.rows = []
+
+    def close(self):
+        if self.writer:
+            self.flush()
+            self.writer.close()
+            self.writer = None
+
+class SqliteSummaryWriter:
+
+    def __init__(self, path, sheet_names, indexed_columns, batch_size = 10000):
+        self.files = [path]
+        self.sheet_names = sheet_names
+        self.indexed_columns = indexed_columns
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.table = None
+        self.columns = None
+        self.sql_insert = None
+        self.rows = []
+
+    def add_sheet(self, sheet_type, columns):
+        self.finish_table()
+        self.table = self.sheet_names[sheet_type]
+        self.columns = columns
+
+        quoted = ['"%s"' % column for column in columns]
+        self.connection.execute('DROP TABLE IF EXISTS "%s"' % self.table)
+        self.connection.execute('CREATE TABLE "%s" (%s)' % (self.table, ', '.join(quoted)))
+        self.sql_insert = 'INSERT INTO "%s" VALUES (%s)' % (self.table, ', '.join(['?'] * len(columns)))
+
+    def write_row(self, irow, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.connection.executemany(self.sql_insert, self.rows)
+            self.rows = []
+
+    def finish_table(self):
+        if self.table:
+            self.flush()
+            # Indexes are built once the table is full
+            for column in self.indexed_columns:
+                if column in self.columns:
+                    name = '%s_%s' % (self.table, column.lower().replace(' ', '_'))
+                    self.connection.execute('CREATE INDEX "%s" ON "%s" ("%s")' % (name, self.table, column))
+            self.connection.commit()
+            self.table = None
+
+    def close(self):
+        self.finish_table()
+        self.connection.close()
+
+class CrossrefCache:
+
+    def __init__(self, path, ttl = None, max_entries = None):
+        self.path = path
+        self.ttl = ttl # Seconds, None to keep the records, 0 to always fetch them again
+        self.max_entries = max_entries
+        self.pending = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS works (doi TEXT PRIMARY KEY, data TEXT, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS works_accessed ON works (accessed)")
+        self.connection.commit()
+
+    def get(self, doi):
+        # Returns (hit, data), data is None for DOIs unknown to Crossref
+        with self.lock:
+            row = self.connection.execute("SELECT data, created FROM works WHERE doi = ?", (doi,)).fetchone()
+            if row is None:
+                return False, None
+
+            data, created = row
+            now = time.time()
+            if self.ttl is not None and now - created >= self.ttl:
+                return False, None
+
+            self.connection.execute("UPDATE works SET accessed = ? WHERE doi = ?", (now, doi))
+            self.flush()
+
+        return True, json.loads(data) if data is not None else None
+
+    def put(self, doi, data):
+        now = time.time()
+        data = json.dumps(data) if data is not None else None
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO works (doi, data, created, accessed) VALUES (?, ?, ?, ?)", (doi, data, now, now))
+            self.flush()
+
+    def flush(self, force = False):
+        self.pending += 1
+        if force or self.pending >= 500:
+            self.connection.commit()
+            self.pending = 0
+
+    def evict(self):
+        with self.lock:
+            if self.ttl is not None:
+                self.connection.execute("DELETE FROM works WHERE created <= ?", (time.time() - self.ttl,))
+            if self.max_entries:
+                # Least recently used first
+                self.connection.execute("DELETE FROM works WHERE doi IN (SELECT doi FROM works ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.connection.commit()
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.connection.close()
+
+class Record:
+    # One row of a sheet, in the order of the parsed columns. The provenance is
+    # a bitmask over RemoveDuplicate.REPOSITORIES, written as
+    # 'Scopus/Web of Science/...' only in the output
+    __slots__ = ('title', 'abstract', 'year', 'doi', 'document_type', 'language', 'cited_by', 'authors', 'title_key', 'doi_key', 'duplicate_type', 'repositories')
+
+    def __init__(self, title, abstract, year, doi, document_type, language, cited_by, authors, title_key, doi_key, duplicate_type = None, repositories = 0):
+        self.title = title
+        self.abstract = abstract
+        self.year = year
+        self.doi = doi
+        self.document_type = document_type
+        self.language = language
+        self.cited_by = cited_by
+        self.authors = authors
+        self.title_key = title_key
+        self.doi_key = doi_key
+        self.duplicate_type = duplicate_type
+        self.repositories = repositories
+
 class RemoveDuplicate:
 
-    def __init__(self):
+    def __init__(self, crossref_client = None):
         self.VERSION = 1.0
+        self.DATA_FORMAT = 4 # Layout of the parsed sheets and the dedup index
 
         self.INPUT_XLS_FILES = None
         self.OUTPUT_PATH = None
         self.DICT_XLS_FILES = {}
+        self.xls_sheets = {} # Parsed sheets of each repository
+        self.JOBS = None # Processes parsing the input files, all the CPUs by default
+        self.XLS_ENGINE = 'auto'
+        self.XLS_ENGINES = ['auto', 'calamine', 'openpyxl']
+        self.MP_START_METHOD = None # Of the parsing processes, None for the default one
+        self.NAME_PARSE_CACHE = 'parse_cache'
+        self.PARSE_CACHE_PATH = None # Parsed input sheets, by content hash
+
+        # Checkpoints of the stages, in the output folder
+        self.NAME_CHECKPOINT = 'checkpoint'
+        self.NAME_CHECKPOINT_MERGE = 'merge.pkl'
+        self.NAME_CHECKPOINT_ENRICHMENT = 'enrichment.jsonl'
+        self.CHECKPOINT_PATH = None
+        self.RESUME = False
+        self.checkpoint_file = None
+        self.input_hashes = None
+
+        # Near-duplicate titles, MinHash/LSH over character shingles
+        self.FUZZY_TITLES = None # Jaccard threshold, None to join exact titles only
+        self.FUZZY_THRESHOLD = 0.85
+        self.FUZZY_SHINGLE = 4
+        self.FUZZY_BANDS = 16
+        self.FUZZY_ROWS = 4
+        self.FUZZY_MIN_SUBTITLE_WORDS = 4
+        self.re_not_word = re.compile(r'[\W_]+')
+        self.re_number = re.compile(r'\d+')
+        self.re_subtitle = re.compile(r'\s*[:;]\s+|\s+[-\u2013\u2014]\s+')
+
+        # Dedup index of a project, for incremental runs
+        self.STATE_FILE = None
+        self.merge_state = None
+        self.enrichment_results = {} # DOI -> get_complement() result
 
         self.ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
         self.LOG_NAME = "run_%s_%s.log" % (os.path.splitext(os.path.basename(__file__))[0], time.strftime('%Y%m%d'))
         self.LOG_FILE = None
 
+        # Crossref cache
+        self.NAME_CACHE_FILE = 'crossref_cache.sqlite'
+        self.CACHE_FILE = None
+        self.CACHE_TTL = 30 # Days
+        self.CACHE_MAX_ENTRIES = 500000
+        self.WARM_CACHE = False
+        self.USE_CACHE = True
+        self.crossref_cache = None
+        self.CROSSREF_URL = 'https://api.crossref.org'
+        self.CROSSREF_WORKERS = 8
+        self.CROSSREF_BATCH_SIZE = 50
+        self.CROSSREF_POOL_SIZE = None # Same as CROSSREF_WORKERS
+        self.CROSSREF_TIMEOUT = 30 # Seconds
+        self.CROSSREF_MAILTO = None
+        self.CROSSREF_RETRIES = 4
+        self.CROSSREF_BREAKER_FAILURES = 5 # Failed requests in a row
+        self.CROSSREF_BREAKER_COOLDOWN = 60 # Seconds
+        self.crossref_unverified = set() # DOIs of title groups Crossref couldn't answer for
+
+        # Library use, without printing
+        self.QUIET = False
+
+        # Service mode
+        self.SERVE = False
+        self.SERVE_HOST = '127.0.0.1'
+        self.SERVE_PORT = 8750
+        self.SERVE_WORKERS = 1
+
+        # Metrics of the stages, saved as JSON next to the log
+        self.METRICS_FILE = None
+        self.PROFILE_FILE = None
+        self.TRACE_MEMORY = False # Peak memory of each stage, with tracemalloc
+        self.metrics = {'stages': {}}
+        self.metrics_lock = threading.Lock()
+        self.current_stage = None
+        self.stage_peaks = [] # Traced peak so far of the enclosing stages
+        self.crossref_client = crossref_client # Injected clients are not closed here
+        self.own_crossref_client = False
+        self.crossref_records = {} # Lookups of this run
+        self.crossref_stats = {} # Requests of this run, the client may be shared
+        self.crossref_deadline = None # Of the enrichment, for the requests already running
+        self.ENRICH_BUDGET = None # Seconds
+        self.ENRICH_MAX_REQUESTS = None
+
         # Repositories
         self.REPOSITORY_SCOPUS = "Scopus"
         self.REPOSITORY_WOS = "Web of Science"
@@ -104,6 +720,21 @@ class RemoveDuplicate:
         self.REPOSITORY_BVS = "BVS"
         self.REPOSITORY_CAB = "CAB"
         self.REPOSITORY_SCIELO = "SciELO"
+        # Bit of each repository in the provenance of the records, in merge order
+        self.REPOSITORIES = [self.REPOSITORY_SCOPUS,
+                             self.REPOSITORY_WOS,
+                             self.REPOSITORY_PUBMED,
+                             self.REPOSITORY_PUBMED_CENTRAL,
+                             self.REPOSITORY_DIMENSIONS,
+                             self.REPOSITORY_GOOGLE_SCHOLAR,
+                             self.REPOSITORY_COCHRANE,
+                             self.REPOSITORY_EMBASE,
+                             self.REPOSITORY_SCIENCEDIRECT,
+                             self.REPOSITORY_IEEE,
+                             self.REPOSITORY_BVS,
+                             self.REPOSITORY_CAB,
+                             self.REPOSITORY_SCIELO]
+        self.repository_names = {} # Bitmask -> 'Scopus/Web of Science/...'
 
         # Xls Summary
         # Input
@@ -139,6 +770,19 @@ class RemoveDuplicate:
         self.XLS_SHEET_UNIQUE = 'Unique'
         self.XLS_SHEET_WITHOUT_DOI = 'Without DOI'
         self.XLS_SHEET_DUPLICATES = 'Duplicates'
+        self.SHEET_NAMES = {self.XLS_SHEET_UNIQUE: 'unique',
+                            self.XLS_SHEET_WITHOUT_DOI: 'without_doi',
+                            self.XLS_SHEET_DUPLICATES: 'duplicates'}
+
+        # Output formats
+        self.FORMAT_XLSX = 'xlsx'
+        self.FORMAT_CSV = 'csv'
+        self.FORMAT_TSV = 'tsv'
+        self.FORMAT_JSONL = 'jsonl'
+        self.FORMAT_PARQUET = 'parquet'
+        self.FORMAT_SQLITE = 'sqlite'
+        self.OUTPUT_FORMATS = [self.FORMAT_XLSX]
+        self.ALL_OUTPUT_FORMATS = [self.FORMAT_XLSX, self.FORMAT_CSV, self.FORMAT_TSV, self.FORMAT_JSONL, self.FORMAT_PARQUET, self.FORMAT_SQLITE]
 
         # Xls Columns
         self.xls_col_item = 'Item'
@@ -151,11 +795,25 @@ class RemoveDuplicate:
         self.xls_col_cited_by = 'Cited By'
         self.xls_col_authors = 'Author(s)'
         self.xls_col_repository = 'Repository'
+        self.xls_col_title_key = 'Title Key' # Internal, not written to the output
+        self.xls_col_doi_key = 'DOI Key' # Internal, not written to the output
 
         self.xls_col_duplicate_type = 'Duplicate Type'
         self.xls_val_by_doi = 'By DOI'
         self.xls_val_by_title = 'By Title'
 
+        # Output column -> Record attribute
+        self.record_fields = {self.xls_col_title: 'title',
+                              self.xls_col_abstract: 'abstract',
+                              self.xls_col_year: 'year',
+                              self.xls_col_doi: 'doi',
+                              self.xls_col_document_type: 'document_type',
+                              self.xls_col_languaje: 'language',
+                              self.xls_col_cited_by: 'cited_by',
+                              self.xls_col_authors: 'authors',
+                              self.xls_col_repository: 'repositories',
+                              self.xls_col_duplicate_type: 'duplicate_type'}
+
         self.xls_columns = [self.xls_col_item,
                             self.xls_col_title,
                             self.xls_col_abstract,
@@ -175,6 +833,14 @@ class RemoveDuplicate:
         self.crossref_created_date_parts = 'date-parts'
         self.crossref_type = 'type'
         self.crossref_language = 'language'
+        self.crossref_doi = 'DOI'
+        self.crossref_fields = [self.crossref_doi,
+                                self.crossref_title,
+                                self.crossref_abstract,
+                                self.crossref_cited_by,
+                                self.crossref_created,
+                                self.crossref_type,
+                                self.crossref_language]
 
         # Status DOI
         self.status_inactive_doi = 'Inactive DOIs'
@@ -188,6 +854,9 @@ class RemoveDuplicate:
         self.END = '\033[0m'
 
     def show_print(self, message, logs = None, showdate = True, font = None, end = None):
+        if self.QUIET:
+            return
+
         msg_print = message
         msg_write = message
 
@@ -218,6 +887,87 @@ class RemoveDuplicate:
         else:
             return "%s: %s" % (message, runtime)
 
+    def get_peak_memory(self):
+        # Peak resident memory of the process so far in MB, None if unknown
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+    @contextlib.contextmanager
+    def stage(self, name, records = 0):
+        # Time, records, peak memory and Crossref traffic of a stage. Stages run
+        # more than once (one per repository) are added up. The peak memory of
+        # the stage is only known when tracemalloc is tracing, the one of the
+        # process is the peak so far
+        metrics = self.metrics['stages'].setdefault(name, {'seconds': 0, 'records': 0, 'rows_per_second': None, 'peak_memory_mb': None, 'process_peak_memory_mb': None, 'crossref': {}})
+        metrics['records'] += records
+        crossref_stats = dict(self.crossref_stats)
+        previous_stage = self.current_stage
+        self.current_stage = name
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # The peak of the enclosing stage is kept before starting this one
+            if self.stage_peaks:
+                self.stage_peaks[-1] = max(self.stage_peaks[-1], tracemalloc.get_traced_memory()[1])
+            self.stage_peaks.append(0)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics['seconds'] += time.perf_counter() - start
+            if metrics['seconds'] > 0 and metrics['records']:
+                metrics['rows_per_second'] = round(metrics['records'] / metrics['seconds'], 1)
+            if tracing:
+                peak = max(self.stage_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.stage_peaks:
+                    self.stage_peaks[-1] = max(self.stage_peaks[-1], peak)
+                metrics['peak_memory_mb'] = max(metrics['peak_memory_mb'] or 0, round(peak / 2**20, 1))
+            metrics['process_peak_memory_mb'] = self.get_peak_memory()
+            for counter, value in list(self.crossref_stats.items()):
+                if value - crossref_stats.get(counter, 0):
+                    self.count_metric(counter, value - crossref_stats.get(counter, 0))
+            self.current_stage = previous_stage
+
+    def count_metric(self, counter, n = 1):
+        # Crossref counters of the running stage, also from the worker threads
+        if self.current_stage is None:
+            return
+        with self.metrics_lock:
+            counters = self.metrics['stages'][self.current_stage]['crossref']
+            counters.update({counter: counters.get(counter, 0) + n})
+
+    def save_metrics(self, status, counts = None):
+        if not self.METRICS_FILE:
+            return
+
+        crossref = {}
+        for _, metrics in self.metrics['stages'].items():
+            metrics['seconds'] = round(metrics['seconds'], 3)
+            for counter, value in metrics['crossref'].items():
+                crossref.update({counter: crossref.get(counter, 0) + value})
+
+        self.metrics.update({'version': self.VERSION,
+                             'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                             'status': status,
+                             'files': self.DICT_XLS_FILES,
+                             'counts': counts or {},
+                             'crossref': crossref,
+                             'process_peak_memory_mb': self.get_peak_memory()})
+        with open(self.METRICS_FILE, 'w', encoding = 'utf-8') as f:
+            json.dump(self.metrics, f, indent = 2)
+
+    def get_serve_address(self, address):
+        # (host, port) from HOST:PORT, PORT or HOST, for --serve
+        host, colon, port = address.strip().rpartition(':')
+        if not colon and port and not port.isdigit():
+            host, port = port, str(self.SERVE_PORT)
+        if not port.isdigit() or int(port) > 65535:
+            raise argparse.ArgumentTypeError("invalid address '%s', use HOST:PORT, PORT or HOST" % address)
+
+        return host or self.SERVE_HOST, int(port)
+
     def create_directory(self, path):
         output = True
         try:
@@ -234,28 +984,193 @@ class RemoveDuplicate:
                 _check = True
         return _check
 
-    def remove_endpoint(self, text):
-        _text = text.strip()
+    def normalize_doi(self, doi):
+        return str(doi).strip().lower() if doi else None
+
+    def open_crossref(self):
+        self.get_crossref_client()
+        if self.USE_CACHE:
+            if self.CACHE_FILE is None:
+                self.CACHE_FILE = os.path.join(self.OUTPUT_PATH, self.NAME_CACHE_FILE)
+            self.crossref_cache = CrossrefCache(self.CACHE_FILE, ttl = self.CACHE_TTL * 86400, max_entries = self.CACHE_MAX_ENTRIES)
+
+    def close_crossref(self):
+        if self.crossref_cache:
+            self.crossref_cache.close()
+            self.crossref_cache = None
+
+        if self.crossref_client and self.own_crossref_client:
+            self.crossref_client.close()
+            self.crossref_client = None
+            self.own_crossref_client = False
+
+    def parse_crossref(self, response):
+        data = {self.crossref_title: None,
+                self.crossref_abstract: None,
+                self.crossref_created: None,
+                self.crossref_cited_by: None,
+                self.crossref_language: None,
+                self.crossref_type: None}
+
+        try:
+            data[self.crossref_title] = response[self.crossref_title][0]
+        except Exception as e:
+            pass
+
+        try:
+            data[self.crossref_created] = response[self.crossref_created][self.crossref_created_date_parts][0][0]
+        except Exception as e:
+            pass
+
+        for field in [self.crossref_abstract, self.crossref_cited_by, self.crossref_language, self.crossref_type]:
+            data[field] = response.get(field)
+
+        return data
+
+    def get_crossref_client(self):
+        if self.crossref_client is None:
+            pool_size = self.CROSSREF_POOL_SIZE or self.CROSSREF_WORKERS
+            user_agent = 'remove-duplicates/%s (https://github.com/glenjasper/remove-duplicates)' % self.VERSION
+            self.crossref_client = CrossrefClient(self.CROSSREF_URL, pool_size = max(1, pool_size), timeout = self.CROSSREF_TIMEOUT, mailto = self.CROSSREF_MAILTO, user_agent = user_agent,
+                                                  retries = self.CROSSREF_RETRIES, breaker_failures = self.CROSSREF_BREAKER_FAILURES, breaker_cooldown = self.CROSSREF_BREAKER_COOLDOWN)
+            self.own_crossref_client = True
+        return self.crossref_client
+
+    def store_crossref(self, key, response):
+        data = self.parse_crossref(response) if response else None
+        self.crossref_records.update({key: data})
+        if self.crossref_cache:
+            self.crossref_cache.put(key, data)
+
+        return data
+
+    def lookup_crossref(self, key):
+        # Record already known in this run or in the cache
+        if key in self.crossref_records:
+            return True, self.crossref_records[key]
 
-        while(_text[-1] == '.'):
-            _text = _text[0:len(_text) - 1]
-            _text = _text.strip()
+        if self.crossref_cache:
+            hit, data = self.crossref_cache.get(key)
+            if hit:
+                self.count_metric('cache_hits')
+                self.crossref_records.update({key: data})
+                return True, data
 
-        return _text
+        return False, None
+
+    def get_crossref(self, doi):
+        # Parsed Crossref record, None for unknown DOIs. Network errors are raised
+        key = self.normalize_doi(doi)
+        if key is None:
+            return None
+
+        hit, data = self.lookup_crossref(key)
+        if hit:
+            return data
+
+        response = self.get_crossref_client().work(key, stats = self.crossref_stats, deadline = self.crossref_deadline)
+
+        return self.store_crossref(key, response)
+
+    def get_crossref_batch(self, keys):
+        try:
+            responses = self.get_crossref_client().works(keys, self.crossref_fields, stats = self.crossref_stats, deadline = self.crossref_deadline)
+        except Exception as e:
+            return None # They will be looked up one by one
+
+        # DOIs missing from the answer are left for the single lookups, only
+        # /works/{doi} says a DOI is unknown
+        n_found = 0
+        for key, response in responses.items():
+            if response:
+                self.store_crossref(key, response)
+                n_found += 1
+
+        return n_found
+
+    def prefetch_crossref(self, dois, deadline = None, progress = True):
+        # Looks up the unknown DOIs in multi-DOI requests, keeping their order
+        keys = []
+        for doi in dois:
+            key = self.normalize_doi(doi)
+            if key and ',' not in key and not self.lookup_crossref(key)[0]:
+                keys.append(key)
+        keys = list(dict.fromkeys(keys))
+
+        size = max(1, self.CROSSREF_BATCH_SIZE)
+        batches = [tuple(keys[i:i + size]) for i in range(0, len(keys), size)]
+        if batches:
+            self.map_crossref(self.get_crossref_batch, batches, deadline, progress)
+
+        return len(keys)
+
+    def warm_cache(self, collections):
+        if not self.crossref_cache:
+            return
+
+        dois = []
+        for _, collection in collections.items():
+            for item in collection:
+                dois.append(item.doi_key)
+
+        self.show_print("Warming Crossref cache", [self.LOG_FILE])
+        n_missing = self.prefetch_crossref(dois)
+        self.show_print("  DOIs fetched: %s" % n_missing, [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+    def map_crossref(self, function, dois, deadline = None, progress = True, on_result = None):
+        # Runs the Crossref lookups concurrently in the given order, returns
+        # {doi: result}. Lookups not started when the deadline passes are dropped.
+        # on_result(doi, result) is called from this thread as results arrive
+        results = {}
+
+        def add_result(doi, result):
+            results.update({doi: result})
+            if on_result:
+                on_result(doi, result)
+
+        self.get_crossref_client() # Shared by the workers
+        with tqdm(total = len(dois), disable = not progress or self.QUIET) as pbar:
+            executor = ThreadPoolExecutor(max_workers = max(1, self.CROSSREF_WORKERS))
+            futures = {executor.submit(function, doi): doi for doi in dois}
+            try:
+                timeout = None if deadline is None else max(0, deadline - time.time())
+                for future in as_completed(futures, timeout = timeout):
+                    add_result(futures[future], future.result())
+                    pbar.update(1)
+            except TimeoutError as e:
+                pass
+            finally:
+                executor.shutdown(wait = True, cancel_futures = True)
+
+            # Lookups that were already running
+            for future, doi in futures.items():
+                if doi not in results and not future.cancelled():
+                    add_result(doi, future.result())
+                    pbar.update(1)
+
+        return results
 
     def check_doi(self, doi):
+        # True for an active DOI, False for an inactive one or one Crossref
+        # doesn't know, None if Crossref couldn't be reached
+        self.count_metric('doi_checks')
         try:
-            works = Works()
-            response = works.doi(doi)
+            response = self.get_crossref(doi)
 
             is_valid = False
             status = None
             if response:
-                status = response[self.crossref_title][0]
-                if status != self.status_inactive_doi:
+                status = response[self.crossref_title]
+                if status and status != self.status_inactive_doi:
                     is_valid = True
 
             return is_valid
+        except CrossrefUnavailable as e:
+            # Unknown, not inactive: the record is kept instead of becoming a
+            # 'By Title' duplicate of a record that may be the wrong one
+            self.crossref_unverified.add(self.normalize_doi(doi))
+            return None
         except Exception as e:
             return False
 
@@ -492,12 +1407,9 @@ class RemoveDuplicate:
         return r
 
     def get_complement(self, doi):
+        self.count_metric('complement_calls')
         try:
-            works = Works()
-            response = works.doi(doi)
-
-            # response['reference'] = ''
-            # pprint(response)
+            response = self.get_crossref(doi)
 
             abstract = None
             year = None
@@ -505,8 +1417,8 @@ class RemoveDuplicate:
             language = None
             document_type = None
             if response:
-                try:
-                    abstract = response[self.crossref_abstract]
+                abstract = response[self.crossref_abstract]
+                if abstract:
                     abstract = abstract.replace('\n', ' ')
                     abstract = abstract.replace('<jats:title>', '').replace('</jats:title>', ': ')
                     abstract = abstract.replace('<jats:sec>', '').replace('</jats:sec>', '')
@@ -520,167 +1432,523 @@ class RemoveDuplicate:
                         abstract = abstract.replace('  ', ' ')
 
                     abstract = abstract.strip()
-                except Exception as e:
-                    pass
-
-                try:
-                    year = response[self.crossref_created][self.crossref_created_date_parts][0][0]
-                except Exception as e:
-                    pass
 
-                try:
-                    cited_by = response[self.crossref_cited_by]
-                except Exception as e:
-                    pass
+                year = response[self.crossref_created]
+                cited_by = response[self.crossref_cited_by]
 
-                try:
+                if response[self.crossref_language] is not None:
                     language = self.get_language(response[self.crossref_language])
-                except Exception as e:
-                    pass
 
-                try:
+                if response[self.crossref_type] is not None:
                     document_type = self.get_document_type(response[self.crossref_type])
-                except Exception as e:
-                    pass
 
             return abstract, year, cited_by, language, document_type
+        except CrossrefUnavailable as e:
+            return None # Not looked up, unlike a DOI without data
         except Exception as e:
             return None, None, None, None, None
 
-    def save_xls(self, dict_unique, dict_without_doi, dict_duplicates):
-
-        def create_sheet(oworkbook, sheet_type, dictionary, styles_title, styles_rows):
-
-            def add_row(pbar = None):
-                icol = 0
-                for irow, item in dictionary.items():
-                    col_doi = item[self.xls_col_doi]
-                    col_abstract = item[self.xls_col_abstract]
-                    col_year = item[self.xls_col_year]
-                    col_cited_by = item[self.xls_col_cited_by]
-                    col_language = item[self.xls_col_languaje]
-                    col_document_type = item[self.xls_col_document_type]
-
-                    if pbar:
-                        if col_abstract is None or col_year is None or col_cited_by is None or col_language is None or col_document_type is None:
-                            _abstract, _year, _cited_by, _language, _document_type = self.get_complement(col_doi)
-
-                            col_abstract = _abstract if col_abstract is None else col_abstract
-                            col_year = _year if col_year is None else col_year
-                            col_cited_by = _cited_by if col_cited_by is None else col_cited_by
-                            col_language = _language if col_language is None else col_language
-                            col_document_type = _document_type if col_document_type is None else col_document_type
-                            pbar.update(1)
-
-                    worksheet.write(irow, icol + 0, irow, styles_rows)
-                    worksheet.write(irow, icol + 1, item[self.xls_col_title], styles_rows)
-                    worksheet.write(irow, icol + 2, col_abstract, styles_rows)
-                    worksheet.write(irow, icol + 3, col_year, styles_rows)
-                    worksheet.write(irow, icol + 4, col_doi, styles_rows)
-                    worksheet.write(irow, icol + 5, col_document_type, styles_rows)
-                    worksheet.write(irow, icol + 6, col_language, styles_rows)
-                    worksheet.write(irow, icol + 7, col_cited_by, styles_rows)
-                    worksheet.write(irow, icol + 8, item[self.xls_col_authors], styles_rows)
-                    worksheet.write(irow, icol + 9, item[self.xls_col_repository], styles_rows)
-                    if sheet_type == self.XLS_SHEET_DUPLICATES:
-                        worksheet.write(irow, icol + 10, item[self.xls_col_duplicate_type], styles_rows)
-
-            if sheet_type == self.XLS_SHEET_DUPLICATES:
-                self.xls_columns.append(self.xls_col_duplicate_type)
-
-            _last_col = len(self.xls_columns) - 1
-
-            worksheet = oworkbook.add_worksheet(sheet_type)
-            worksheet.freeze_panes(row = 1, col = 0) # Freeze the first row.
-            worksheet.autofilter(first_row = 0, first_col = 0, last_row = 0, last_col = _last_col)
-            worksheet.set_default_row(height = 14.5)
-
-            # Add columns
-            for icol, column in enumerate(self.xls_columns):
-                worksheet.write(0, icol, column, styles_title)
-
-            # Add rows
-            worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
-            worksheet.set_column(first_col = 1, last_col = 1, width = 30) # Column B:B
-            worksheet.set_column(first_col = 2, last_col = 2, width = 33) # Column C:C
-            worksheet.set_column(first_col = 3, last_col = 3, width = 8)  # Column D:D
-            worksheet.set_column(first_col = 4, last_col = 4, width = 30) # Column E:E
-            worksheet.set_column(first_col = 5, last_col = 5, width = 18) # Column F:F
-            worksheet.set_column(first_col = 6, last_col = 6, width = 12) # Column G:G
-            worksheet.set_column(first_col = 7, last_col = 7, width = 11) # Column H:H
-            worksheet.set_column(first_col = 8, last_col = 8, width = 18) # Column I:I
-            worksheet.set_column(first_col = 9, last_col = 9, width = 13) # Column J:J
-            if sheet_type == self.XLS_SHEET_DUPLICATES:
-                worksheet.set_column(first_col = 10, last_col = 10, width = 17) # Column K:K
-
-            total = 0
-            for irow, item in dictionary.items():
-                col_abstract = item[self.xls_col_abstract]
-                col_year = item[self.xls_col_year]
-                col_cited_by = item[self.xls_col_cited_by]
-                col_language = item[self.xls_col_languaje]
-                col_document_type = item[self.xls_col_document_type]
-
-                if col_abstract is None or col_year is None or col_cited_by is None or col_language is None or col_document_type is None:
-                    total += 1
-
-            if sheet_type == self.XLS_SHEET_UNIQUE:
-                with tqdm(total = total) as pbar:
-                    add_row(pbar)
-            elif sheet_type in [self.XLS_SHEET_WITHOUT_DOI, self.XLS_SHEET_DUPLICATES]:
-                add_row()
-
-        workbook = xlsxwriter.Workbook(self.XLS_FILE_OUTPUT)
-
-        # Styles
-        cell_format_title = workbook.add_format({'bold': True,
-                                                 'font_color': 'white',
-                                                 'bg_color': 'black',
-                                                 'align': 'center',
-                                                 'valign': 'vcenter'})
-        cell_format_row = workbook.add_format({'text_wrap': True, 'valign': 'top'})
+    def enrich_collection(self, collection):
+        # Fill the missing fields of the records from Crossref, before writing
+        fields = [self.record_fields[column] for column in [self.xls_col_abstract, self.xls_col_year, self.xls_col_cited_by, self.xls_col_languaje, self.xls_col_document_type]]
+
+        pending = {}
+        n_missing = {}
+        n_known = 0
+        for item in collection:
+            _n_missing = sum(1 for field in fields if getattr(item, field) is None)
+            if _n_missing > 0:
+                doi = item.doi_key
+                if doi in self.enrichment_results:
+                    # Looked up in a previous run of the project
+                    for field, value in zip(fields, self.enrichment_results[doi]):
+                        if getattr(item, field) is None:
+                            setattr(item, field, value)
+                    n_known += 1
+                    continue
+
+                pending.setdefault(doi, []).append(item)
+                n_missing.update({doi: max(_n_missing, n_missing.get(doi, 0))})
+
+        # The most incomplete rows first
+        dois = sorted(pending.keys(), key = lambda doi: -n_missing[doi])
+        if self.ENRICH_MAX_REQUESTS is not None:
+            dois = dois[:self.ENRICH_MAX_REQUESTS]
+        deadline = time.time() + self.ENRICH_BUDGET if self.ENRICH_BUDGET is not None else None
 
         self.show_print("Getting additional information from Crossref [Abstract, Document Type, Language, Year, Cited by]", [self.LOG_FILE])
-        create_sheet(workbook, self.XLS_SHEET_UNIQUE, dict_unique, cell_format_title, cell_format_row)
-        create_sheet(workbook, self.XLS_SHEET_WITHOUT_DOI, dict_without_doi, cell_format_title, cell_format_row)
-        create_sheet(workbook, self.XLS_SHEET_DUPLICATES, dict_duplicates, cell_format_title, cell_format_row)
+        if n_known > 0:
+            self.show_print("  Rows filled from previous runs: %s" % n_known, [self.LOG_FILE])
+        # One round of batch requests at a time, so the results are saved in
+        # the checkpoint as they arrive
+        results = {}
+        size = max(1, self.CROSSREF_BATCH_SIZE) * max(1, self.CROSSREF_WORKERS)
+        self.crossref_deadline = deadline # Also for the lookups already running
+        with tqdm(total = len(dois), disable = self.QUIET) as pbar:
+            for i in range(0, len(dois), size):
+                if deadline is not None and time.time() >= deadline:
+                    break
+                chunk = dois[i:i + size]
+                self.prefetch_crossref(chunk, deadline, progress = False)
+                if deadline is not None and time.time() >= deadline:
+                    # Budget spent in the batch requests, only the records they
+                    # got, without starting single lookups
+                    for doi in chunk:
+                        if self.lookup_crossref(self.normalize_doi(doi))[0]:
+                            results.update({doi: self.get_complement(doi)})
+                            self.checkpoint_enrichment(doi, results[doi])
+                    pbar.update(len(chunk))
+                    break
+                results.update(self.map_crossref(self.get_complement, chunk, deadline, progress = False, on_result = self.checkpoint_enrichment))
+                pbar.update(len(chunk))
+        self.crossref_deadline = None
+
+        # Crossref unavailable or stopped by the budget, left for the next run
+        budget_reached = deadline is not None and time.time() >= deadline
+        n_unavailable = 0
+        for doi in [doi for doi, result in results.items() if result is None]:
+            if not budget_reached:
+                n_unavailable += len(pending[doi])
+            del results[doi]
+        self.enrichment_results.update(results)
+
+        n_skipped = -n_unavailable
+        for doi, items in pending.items():
+            if doi not in results:
+                n_skipped += len(items)
+                continue
+
+            for item in items:
+                for field, value in zip(fields, results[doi]):
+                    if getattr(item, field) is None:
+                        setattr(item, field, value)
+
+        if n_skipped > 0:
+            self.show_print("Enrichment budget reached, rows left un-enriched: %s" % n_skipped, [self.LOG_FILE], font = self.YELLOW)
+        if n_unavailable > 0:
+            self.show_print("Crossref unavailable, rows left un-enriched: %s" % n_unavailable, [self.LOG_FILE], font = self.YELLOW)
         self.show_print("", [self.LOG_FILE])
 
-        workbook.close()
-
-    def read_xls_summary(self, xlsfile, this_sheet):
-        df = pd.read_excel(io = xlsfile, sheet_name = this_sheet)
-        # df = df.where(pd.notnull(df), None)
-        df = df.replace({np.nan: None})
-        # print(df)
-
-        file_collection = {}
-        dois = []
-        for index, row in df.iterrows():
-            doi = row[self.xls_col_doi]
-            title = row[self.xls_col_title]
-            title = self.remove_endpoint(title) if title else title
-
-            collection = {}
-            collection.update({self.xls_col_item: row[self.xls_col_item],
-                               self.xls_col_title: title,
-                               self.xls_col_abstract: row[self.xls_col_abstract],
-                               self.xls_col_year: row[self.xls_col_year],
-                               self.xls_col_doi: doi,
-                               self.xls_col_document_type: row[self.xls_col_document_type],
-                               self.xls_col_languaje: row[self.xls_col_languaje],
-                               self.xls_col_cited_by: row[self.xls_col_cited_by],
-                               self.xls_col_authors: row[self.xls_col_authors]})
-
-            if this_sheet == self.XLS_SHEET_DUPLICATES:
-                collection.update({self.xls_col_duplicate_type: row[self.xls_col_duplicate_type]})
-
+    def get_sheet_columns(self, sheet_type):
+        columns = self.xls_columns.copy()
+        if sheet_type == self.XLS_SHEET_DUPLICATES:
+            columns.append(self.xls_col_duplicate_type)
+        return columns
+
+    def get_repository_bit(self, repository):
+        if repository not in self.REPOSITORIES:
+            self.REPOSITORIES.append(repository)
+        return 1 << self.REPOSITORIES.index(repository)
+
+    def get_repositories(self, repositories):
+        # 'Scopus/Web of Science/...' from the bitmask, the same few are repeated
+        names = self.repository_names.get(repositories)
+        if names is None:
+            names = '/'.join([repository for bit, repository in enumerate(self.REPOSITORIES) if repositories >> bit & 1])
+            self.repository_names.update({repositories: names})
+        return names
+
+    def iter_sheet_rows(self, sheet_type, records):
+        # Output rows in order, the Item column is the row number
+        columns = self.get_sheet_columns(sheet_type)
+        get_fields = operator.attrgetter(*[self.record_fields[column] for column in columns[1:]])
+        index_repository = columns.index(self.xls_col_repository)
+        for irow, item in enumerate(records, start = 1):
+            row = [irow, *get_fields(item)]
+            row[index_repository] = self.get_repositories(item.repositories)
+            yield irow, row
+
+    def get_summary_writers(self):
+        base = os.path.splitext(self.XLS_FILE_OUTPUT)[0]
+        writers = []
+        for output_format in self.OUTPUT_FORMATS:
+            if output_format == self.FORMAT_XLSX:
+                writers.append(XlsxSummaryWriter(self.XLS_FILE_OUTPUT))
+            elif output_format in [self.FORMAT_CSV, self.FORMAT_TSV]:
+                writers.append(CsvSummaryWriter(base, output_format, self.SHEET_NAMES))
+            elif output_format == self.FORMAT_JSONL:
+                writers.append(JsonlSummaryWriter(base, self.SHEET_NAMES))
+            elif output_format == self.FORMAT_PARQUET:
+                writers.append(ParquetSummaryWriter(base, self.SHEET_NAMES, self.xls_col_item))
+            elif output_format == self.FORMAT_SQLITE:
+                writers.append(SqliteSummaryWriter('%s.sqlite' % base, self.SHEET_NAMES, [self.xls_col_doi, self.xls_col_title]))
+
+        return writers
+
+    def save_summary(self, collect_unique, collect_without_doi, collect_duplicates):
+        # Every partition is read once, each row goes to all the writers
+        writers = self.get_summary_writers()
+        partitions = [(self.XLS_SHEET_UNIQUE, collect_unique),
+                      (self.XLS_SHEET_WITHOUT_DOI, collect_without_doi),
+                      (self.XLS_SHEET_DUPLICATES, collect_duplicates)]
+        for sheet_type, records in partitions:
+            columns = self.get_sheet_columns(sheet_type)
+            for writer in writers:
+                writer.add_sheet(sheet_type, columns)
+
+            for irow, row in self.iter_sheet_rows(sheet_type, records):
+                for writer in writers:
+                    writer.write_row(irow, row)
+
+        files = []
+        for writer in writers:
+            writer.close()
+            files.extend(writer.files)
+
+        return files
+
+    def get_xls_engine(self):
+        # calamine (python-calamine) is much faster than openpyxl, when installed
+        if self.XLS_ENGINE == 'auto':
+            return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+        return self.XLS_ENGINE
+
+    def read_xls_file(self, xlsfile):
+        # All the sheets are parsed in one pass over the workbook, only the
+        # columns used here. Numbers are kept as they are read (object)
+        sheets = [self.XLS_SHEET_UNIQUE, self.XLS_SHEET_WITHOUT_DOI, self.XLS_SHEET_DUPLICATES]
+        dtypes = {self.xls_col_title: str,
+                  self.xls_col_abstract: str,
+                  self.xls_col_year: object,
+                  self.xls_col_doi: str,
+                  self.xls_col_document_type: str,
+                  self.xls_col_languaje: str,
+                  self.xls_col_cited_by: object,
+                  self.xls_col_authors: str,
+                  self.xls_col_duplicate_type: str}
+
+        dfs = self.read_parse_cache(xlsfile, sheets)
+        if dfs is None:
+            dfs = pd.read_excel(io = xlsfile, sheet_name = sheets, engine = self.get_xls_engine(), usecols = lambda column: column in dtypes, dtype = dtypes)
+            self.write_parse_cache(xlsfile, dfs)
+
+        xls_sheets = {}
+        for sheet in sheets:
+            xls_sheets.update({sheet: self.read_xls_summary(dfs[sheet], sheet)})
+
+        return xls_sheets
+
+    def get_file_hash(self, file):
+        sha = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    def get_parse_cache_files(self, xlsfile, sheets):
+        # Keyed by the content of the workbook, a changed file is parsed again
+        file_hash = self.get_file_hash(xlsfile)
+
+        files = {}
+        for sheet in sheets:
+            name = '%s_%s_v%s.%s' % (file_hash, self.SHEET_NAMES[sheet], self.VERSION, self.DATA_FORMAT)
+            files.update({sheet: os.path.join(self.PARSE_CACHE_PATH, name)})
+
+        return files
+
+    def read_parse_cache(self, xlsfile, sheets):
+        if not self.PARSE_CACHE_PATH:
+            return None
+
+        dfs = {}
+        for sheet, file in self.get_parse_cache_files(xlsfile, sheets).items():
+            if os.path.exists('%s.arrow' % file):
+                # Arrow IPC (Feather), memory-mapped. Integer columns with blanks
+                # come back as Python ints and None, as read from the workbook
+                import pyarrow.feather
+                table = pyarrow.feather.read_table('%s.arrow' % file, memory_map = True)
+                dfs.update({sheet: table.to_pandas(integer_object_nulls = True)})
+            elif os.path.exists('%s.pkl' % file):
+                dfs.update({sheet: pd.read_pickle('%s.pkl' % file)})
+            else:
+                return None
+
+        return dfs
+
+    def write_parse_cache(self, xlsfile, dfs):
+        if not self.PARSE_CACHE_PATH:
+            return
+
+        self.create_directory(self.PARSE_CACHE_PATH)
+        use_arrow = importlib.util.find_spec('pyarrow') is not None
+        for sheet, file in self.get_parse_cache_files(xlsfile, list(dfs.keys())).items():
+            df = dfs[sheet].reset_index(drop = True)
+            saved = False
+            if use_arrow:
+                try:
+                    df.to_feather('%s.arrow.tmp' % file)
+                    os.replace('%s.arrow.tmp' % file, '%s.arrow' % file)
+                    saved = True
+                except Exception as e:
+                    # Columns mixing numbers and text, Arrow can't store them
+                    if os.path.exists('%s.arrow.tmp' % file):
+                        os.remove('%s.arrow.tmp' % file)
+
+            if not saved:
+                df.to_pickle('%s.pkl.tmp' % file)
+                os.replace('%s.pkl.tmp' % file, '%s.pkl' % file)
+
+    def load_xls_files(self):
+        pending = {repository: file for repository, file in self.DICT_XLS_FILES.items() if repository not in self.xls_sheets}
+        jobs = min(self.JOBS or os.cpu_count() or 1, len(pending))
+        if not pending:
+            return
+
+        with self.stage('load') as metrics:
+            # One workbook per worker process
+            if jobs > 1:
+                with ProcessPoolExecutor(max_workers = jobs, mp_context = multiprocessing.get_context(self.MP_START_METHOD)) as executor:
+                    engines = [self.XLS_ENGINE] * len(pending)
+                    parse_cache_paths = [self.PARSE_CACHE_PATH] * len(pending)
+                    parsed = dict(zip(pending.keys(), executor.map(read_xls_file, pending.values(), engines, parse_cache_paths)))
+            else:
+                parsed = {repository: self.read_xls_file(file) for repository, file in pending.items()}
+
+            for repository, xls_sheets in parsed.items():
+                collections = {}
+                for sheet, rows in xls_sheets.items():
+                    collections.update({sheet: self.get_records(rows)})
+                    metrics['records'] += len(rows)
+                self.xls_sheets.update({repository: collections})
+
+    def read_xls_summary(self, df, this_sheet):
+        # In the order of the Record attributes. The Item column is not kept,
+        # the output rows are numbered again
+        columns = [self.xls_col_title,
+                   self.xls_col_abstract,
+                   self.xls_col_year,
+                   self.xls_col_doi,
+                   self.xls_col_document_type,
+                   self.xls_col_languaje,
+                   self.xls_col_cited_by,
+                   self.xls_col_authors]
+        extra_columns = [self.xls_col_duplicate_type] if this_sheet == self.XLS_SHEET_DUPLICATES else []
+
+        # Column by column, NaN as None
+        data = {}
+        for column in columns + extra_columns:
+            values = df[column].astype(object)
+            data.update({column: values.where(values.notna(), None)})
+
+        # Without the trailing dots of the titles
+        titles = data[self.xls_col_title]
+        is_title = titles.notna()
+        titles = titles.where(~is_title, titles.astype(str))
+        titles = titles.str.strip().str.replace(r'[\s.]+$', '', regex = True)
+        titles = titles.where(is_title, None)
+        title_keys = titles.str.lower()
+        data.update({self.xls_col_title: titles,
+                     self.xls_col_title_key: title_keys.where(title_keys.str.len() > 0, None)})
+        columns.append(self.xls_col_title_key)
+
+        # Canonical DOIs for the join, without 'https://doi.org/', 'doi:',
+        # spaces or trailing punctuation. The DOI column keeps the original value
+        dois = data[self.xls_col_doi]
+        is_doi = dois.notna()
+        doi_keys = dois.where(~is_doi, dois.astype(str)).str.strip().str.lower()
+        doi_keys = doi_keys.str.replace(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', '', regex = True)
+        doi_keys = doi_keys.str.replace(r'[\s.,;]+$', '', regex = True)
+        data.update({self.xls_col_doi_key: doi_keys.where(is_doi & (doi_keys.str.len() > 0), None)})
+        columns.append(self.xls_col_doi_key)
+
+        # Row tuples, compact to send between processes
+        return list(zip(*[data[column].tolist() for column in columns + extra_columns]))
+
+    def get_records(self, rows):
+        return [Record(*row) for row in rows]
+
+    def index_dois(self, collection):
+        # DOI -> record ids, so the join between repositories is a hash lookup
+        index = {}
+        for id_record, item in collection.items():
+            doi = item.doi_key
             if doi:
-                dois.append(doi)
-
-            file_collection.update({index + 1: collection})
-
-        return file_collection, dois
+                index.setdefault(doi, []).append(id_record)
+
+        return index
+
+    def index_titles(self, collection):
+        # Normalized title -> record ids, the group size gives the collisions
+        index = {}
+        for id_record, item in collection.items():
+            title_key = item.title_key
+            if title_key:
+                index.setdefault(title_key, []).append(id_record)
+
+        return index
+
+    def normalize_title(self, title):
+        # Without HTML entities, accents, punctuation and extra spaces
+        if '&' in title:
+            title = html.unescape(title)
+        if not title.isascii():
+            title = ''.join([c for c in unicodedata.normalize('NFKD', title) if not unicodedata.combining(c)])
+
+        return self.re_not_word.sub(' ', title.lower()).strip()
+
+    def get_title_head(self, title):
+        # The title without its subtitle ('Title: subtitle', 'Title - subtitle')
+        parts = self.re_subtitle.split(title, maxsplit = 1)
+        if len(parts) > 1:
+            head = self.normalize_title(parts[0])
+            if len(head.split()) >= self.FUZZY_MIN_SUBTITLE_WORDS:
+                return head
+
+        return None
+
+    def get_title_signatures(self, titles):
+        # MinHash signatures of the character shingles, all titles at once:
+        # the shingles are the 4 byte windows of the concatenated titles
+        n_hashes = self.FUZZY_BANDS * self.FUZZY_ROWS
+        size = self.FUZZY_SHINGLE
+        texts = [(' %s ' % title).encode('utf-8') for title in titles]
+        lengths = np.array([len(text) for text in texts], dtype = np.int64)
+        n_shingles = np.maximum(lengths - size + 1, 1)
+        buffer = np.frombuffer(b''.join(texts) + b'\0' * size, dtype = np.uint8).astype(np.uint64)
+
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        offsets = np.concatenate([[0], np.cumsum(n_shingles)[:-1]])
+        positions = np.repeat(starts - offsets, n_shingles) + np.arange(n_shingles.sum())
+        shingles = np.zeros(len(positions), dtype = np.uint64)
+        for i in range(size):
+            shingles |= buffer[positions + i] << np.uint64(8 * i)
+
+        # Universal hashing, the high 32 bits of a * x + b (mod 2^64)
+        rng = np.random.RandomState(1)
+        a = rng.randint(1, 2**62, size = n_hashes, dtype = np.uint64) | np.uint64(1)
+        b = rng.randint(0, 2**62, size = n_hashes, dtype = np.uint64)
+        signatures = np.empty((len(texts), n_hashes), dtype = np.uint32)
+        with np.errstate(over = 'ignore'):
+            for i in range(n_hashes):
+                hashes = ((shingles * a[i] + b[i]) >> np.uint64(32)).astype(np.uint32)
+                signatures[:, i] = np.minimum.reduceat(hashes, offsets)
+
+        shingle_sets = [shingles[offset:offset + n] for offset, n in zip(offsets, n_shingles)]
+
+        return signatures, shingle_sets
+
+    def get_fuzzy_title_keys(self, title_keys):
+        # Title key -> key of its group. Exact matches after normalizing, LSH
+        # candidate pairs whose Jaccard similarity is at least the threshold,
+        # and titles equal to another one without their subtitle. Groups take
+        # the key of their first title, so the saved keys are kept
+        parent = list(range(len(title_keys)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i, j):
+            i, j = find(i), find(j)
+            if i != j:
+                parent[max(i, j)] = min(i, j)
+
+        index_normalized = {}
+        for i, title_key in enumerate(title_keys):
+            normalized = self.normalize_title(title_key)
+            if normalized in index_normalized:
+                union(index_normalized[normalized], i)
+            else:
+                index_normalized.update({normalized: i})
+
+        # One title per normalized text goes to the LSH
+        ids = list(index_normalized.values())
+        signatures, shingle_sets = self.get_title_signatures(list(index_normalized.keys()))
+        numbers = [self.re_number.findall(title) for title in index_normalized.keys()]
+        cache_sets = {}
+
+        def similarity(i, j):
+            # 'Part 1' and 'Part 2' are different works
+            if numbers[i] != numbers[j]:
+                return 0
+            for k in (i, j):
+                if k not in cache_sets:
+                    cache_sets.update({k: set(shingle_sets[k].tolist())})
+            return len(cache_sets[i] & cache_sets[j]) / len(cache_sets[i] | cache_sets[j])
+
+        for band in range(self.FUZZY_BANDS):
+            rows = np.ascontiguousarray(signatures[:, band * self.FUZZY_ROWS:(band + 1) * self.FUZZY_ROWS])
+            _, buckets = np.unique(rows.view(np.dtype((np.void, rows.dtype.itemsize * self.FUZZY_ROWS))).ravel(), return_inverse = True)
+            buckets = buckets.ravel()
+            # Only the buckets with more than one title
+            order = np.argsort(buckets, kind = 'stable')
+            order = order[np.bincount(buckets)[buckets[order]] > 1]
+            bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+            for bucket in np.split(order, bounds) if len(order) else []:
+                # Big buckets against their first title only, not quadratic
+                pairs = [(bucket[x], bucket[y]) for x in range(len(bucket)) for y in range(x + 1, len(bucket))] if len(bucket) <= 50 else [(bucket[0], y) for y in bucket[1:]]
+                for x, y in pairs:
+                    if find(ids[x]) != find(ids[y]) and similarity(x, y) >= self.FUZZY_TITLES:
+                        union(ids[x], ids[y])
+
+        # A title goes with the same title without its subtitle only if it's
+        # the one work found with that subtitle: 'Title: a review' and
+        # 'Title: a survey' are not joined to 'Title', nor to each other
+        subtitled = {}
+        for i, title_key in enumerate(title_keys):
+            head = self.get_title_head(title_key)
+            if head in index_normalized and self.re_number.findall(head) == self.re_number.findall(self.normalize_title(title_key)):
+                subtitled.setdefault(head, set()).add(find(i))
+        for head, groups in subtitled.items():
+            if len(groups) == 1:
+                union(index_normalized[head], groups.pop())
+
+        return {title_key: title_keys[find(i)] for i, title_key in enumerate(title_keys)}
+
+    def join_fuzzy_titles(self, collections, state = None):
+        # Rewrites the title keys of the records with the key of their group,
+        # the 'By Title' step of the merge does the rest
+        title_keys = list(state['index_title'].keys()) if state else []
+        for _, collection in collections.items():
+            for item in collection:
+                if item.title_key:
+                    title_keys.append(item.title_key)
+        title_keys = list(dict.fromkeys(title_keys))
+        if not title_keys:
+            return
+
+        fuzzy_keys = self.get_fuzzy_title_keys(title_keys)
+        n_joined = 0
+        for _, collection in collections.items():
+            for item in collection:
+                title_key = item.title_key
+                if title_key and fuzzy_keys[title_key] != title_key:
+                    item.title_key = fuzzy_keys[title_key]
+                    n_joined += 1
+
+        self.show_print("Fuzzy titles: %s records joined to a similar title (threshold %s)" % (n_joined, self.FUZZY_TITLES), [self.LOG_FILE])
+
+    def set_input_file(self, xlsfile):
+        # The repository is given by the name of the file
+        if os.path.basename(xlsfile) == self.NAME_XLS_FILE_SCOPUS:
+            self.XLS_FILE_SCOPUS = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_WOS:
+            self.XLS_FILE_WOS = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_PUBMED:
+            self.XLS_FILE_PUBMED = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_PUBMED_CENTRAL:
+            self.XLS_FILE_PUBMED_CENTRAL = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_DIMENSIONS:
+            self.XLS_FILE_DIMENSIONS = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_GOOGLE_SCHOLAR:
+            self.XLS_FILE_GOOGLE_SCHOLAR = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_COCHRANE:
+            self.XLS_FILE_COCHRANE = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_EMBASE:
+            self.XLS_FILE_EMBASE = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_SCIENCEDIRECT:
+            self.XLS_FILE_SCIENCEDIRECT = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_IEEE:
+            self.XLS_FILE_IEEE = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_BVS:
+            self.XLS_FILE_BVS = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_CAB:
+            self.XLS_FILE_CAB = xlsfile
+        elif os.path.basename(xlsfile) == self.NAME_XLS_FILE_SCIELO:
+            self.XLS_FILE_SCIELO = xlsfile
 
     def get_list_files(self):
         if self.XLS_FILE_SCOPUS:
@@ -710,163 +1978,644 @@ class RemoveDuplicate:
         if self.XLS_FILE_SCIELO:
             self.DICT_XLS_FILES.update({self.REPOSITORY_SCIELO: self.XLS_FILE_SCIELO})
 
+    def new_merge_state(self):
+        # Everything needed to merge more repositories later. The provenance of
+        # the records is a bitmask, see get_repository_bit()
+        return {'version': self.DATA_FORMAT,
+                'fuzzy_titles': self.FUZZY_TITLES,
+                'files': [], # (repository, content hash) in merge order
+                'live': {}, # Unique records by global id
+                'duplicates': [],
+                'index_doi': {},
+                'index_title': {},
+                'open_titles': [],
+                'id_record': 0,
+                'enrichment': {}}
+
+    def merge_repository(self, state, repository, collection):
+        # N-way merge, one repository at a time. Records get a global id in
+        # repository order, so the unique set stays ordered by id and every
+        # repository is only matched against the DOI and title indexes of the
+        # records merged so far, giving the same decisions as folding them
+        collect_live = state['live']
+        index_doi = state['index_doi']
+        index_title = state['index_title']
+
+        if not state['files']:
+            # Base repository
+            with self.stage('doi_join', len(collection)):
+                bit = self.get_repository_bit(repository)
+                for item in collection:
+                    state['id_record'] += 1
+                    item.repositories = bit
+                    collect_live.update({state['id_record']: item})
+
+                index_doi.update(self.index_dois(collect_live))
+                index_title.update(self.index_titles(collect_live))
+                state['open_titles'] = [title for title, ids in index_title.items() if len(ids) > 1]
+            return
+
+        with self.stage('doi_join', len(collection)):
+            new_ids = self.join_dois(state, repository, collection)
+        with self.stage('title_resolution', len(new_ids)):
+            self.resolve_titles(state, repository, new_ids)
+
+    def join_dois(self, state, secondary_repository, collection_secondary):
+        # DOI join against the merged records, returns the ids of the new ones
+        collect_live = state['live']
+        index_doi = state['index_doi']
+        collect_duplicate = state['duplicates']
+        dois_secondary = {item.doi_key for item in collection_secondary if item.doi_key}
+        bit = self.get_repository_bit(secondary_repository)
+
+        # Get unique DOIs
+        for doi in dois_secondary:
+            for id_base in index_doi.get(doi, []):
+                collect_live[id_base].repositories |= bit
+
+        new_ids = []
+        for item in collection_secondary:
+            doi = item.doi_key
+            item.repositories = bit
+            if doi in index_doi:
+                item.duplicate_type = self.xls_val_by_doi
+                collect_duplicate.append(item)
+            elif doi in dois_secondary:
+                state['id_record'] += 1
+                collect_live.update({state['id_record']: item})
+                new_ids.append(state['id_record'])
+
+        return new_ids
+
+    def resolve_titles(self, state, secondary_repository, new_ids):
+        # Title groups with new records or still unresolved, checking the DOIs
+        collect_live = state['live']
+        index_doi = state['index_doi']
+        index_title = state['index_title']
+        collect_duplicate = state['duplicates']
+        bit = self.get_repository_bit(secondary_repository)
+
+        # Get duplicate titles
+        touched_titles = dict.fromkeys(state['open_titles'])
+        for id_new in new_ids:
+            item = collect_live[id_new]
+            index_doi.setdefault(item.doi_key, []).append(id_new)
+            title = item.title_key
+            if title:
+                index_title.setdefault(title, []).append(id_new)
+                touched_titles.update({title: None})
+
+        # Get unique titles
+        dois = []
+        for title in touched_titles:
+            if len(index_title[title]) > 1:
+                dois.extend([collect_live[id_row].doi_key for id_row in index_title[title]])
+        self.prefetch_crossref(dois, progress = False)
+
+        removed_ids = []
+        for title in touched_titles:
+            ids = index_title[title]
+            if len(ids) < 2:
+                continue
+
+            nr_title_ctrl = {'n_check': 0, 'is_valid': False, 'repository': None}
+            for id_row in ids:
+                row = collect_live[id_row]
+                flag_unique = False
+
+                _n_check = nr_title_ctrl['n_check']
+                _is_valid = nr_title_ctrl['is_valid']
+                _repository = nr_title_ctrl['repository']
+
+                status = False
+                if not _is_valid:
+                    status = self.check_doi(row.doi_key)
+
+                if status:
+                    flag_unique = True
+                    nr_title_ctrl.update({'is_valid': True})
+                elif status is None:
+                    # Not verified, kept and the next ones are checked too
+                    flag_unique = True
+                else:
+                    if _n_check == 1 and _is_valid is False:
+                        flag_unique = True # forced
+
+                if _repository is None:
+                    _repository = row.repositories
+
+                if flag_unique:
+                    row.repositories = _repository | bit
+                else:
+                    # Only the last repository, the highest bit
+                    row.repositories = 1 << (row.repositories.bit_length() - 1)
+                    removed_ids.append(id_row)
+
+                nr_title_ctrl.update({'n_check': _n_check + 1})
+                nr_title_ctrl.update({'repository': _repository})
+
+        # Title duplicates keep the order of the unique set
+        for id_row in sorted(removed_ids):
+            row = collect_live.pop(id_row)
+            for index, key in [(index_doi, row.doi_key), (index_title, row.title_key)]:
+                if key not in index:
+                    continue # Records without DOI aren't indexed by DOI
+                index[key].remove(id_row)
+                if not index[key]:
+                    del index[key]
+
+            row.duplicate_type = self.xls_val_by_title
+            collect_duplicate.append(row)
+
+        state['open_titles'] = [title for title in touched_titles if len(index_title.get(title, [])) > 1]
+
+    def render_merge(self, state):
+        # The unique and duplicate records in order, new lists of the same
+        # records, so the ones added later don't go into the merge state
+        return list(state['live'].values()), list(state['duplicates'])
+
+    def merge_collections(self, collections, state = None):
+        state = state if state is not None else self.new_merge_state()
+        merged = [repository for repository, _ in state['files']]
+        for repository, collection in collections.items():
+            if repository not in merged:
+                self.merge_repository(state, repository, collection)
+                state['files'].append((repository, None))
+        self.merge_state = state
+
+        return self.render_merge(state)
+
+    def load_merge_state(self, hashes):
+        # Saved merge, usable if the saved files are the first ones of this run
+        # and unchanged. New repositories are merged on top of it. The index
+        # can't take back the records of an updated file: they may have decided
+        # the merge of the repositories after it, so everything is merged again
+        if not self.STATE_FILE or not os.path.exists(self.STATE_FILE):
+            return None
+
+        with open(self.STATE_FILE, 'rb') as f:
+            state = pickle.load(f)
+
+        if state.get('version') != self.DATA_FORMAT:
+            self.show_print("Dedup index from another version, rebuilding it", [self.LOG_FILE], font = self.YELLOW)
+            return None
+
+        files = list(hashes.items())
+        if files[:len(state['files'])] != state['files'] or state['fuzzy_titles'] != self.FUZZY_TITLES:
+            changed = [repository for repository, file_hash in state['files'] if hashes.get(repository) != file_hash]
+            if state['fuzzy_titles'] != self.FUZZY_TITLES:
+                reason = "--fuzzy-titles changed since the dedup index was saved"
+            elif changed:
+                reason = "Files updated or removed since the dedup index was saved: %s" % ', '.join(changed)
+            else:
+                reason = "New files come before the ones in the dedup index in the merge order"
+            self.show_print("%s, merging all the files again" % reason, [self.LOG_FILE], font = self.YELLOW)
+            new_state = self.new_merge_state()
+            new_state.update({'enrichment': state['enrichment']})
+            return new_state
+
+        self.show_print("Dedup index: %s repositories already merged, %s new" % (len(state['files']), len(files) - len(state['files'])), [self.LOG_FILE])
+        return state
+
+    def save_merge_state(self):
+        if not self.STATE_FILE or self.merge_state is None:
+            return
+
+        self.merge_state.update({'enrichment': self.enrichment_results})
+        with open('%s.tmp' % self.STATE_FILE, 'wb') as f:
+            pickle.dump(self.merge_state, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace('%s.tmp' % self.STATE_FILE, self.STATE_FILE)
+
     def get_sheet_data(self):
         self.show_print("Input files:", [self.LOG_FILE], font = self.GREEN)
-        dict_xlsx_files = self.DICT_XLS_FILES.copy()
-
-        for index, (repository, file) in enumerate(dict_xlsx_files.items()):
-            if index == 0:
-                base_repository = repository
-                base_xlsx_file = file
+        for _, file in self.DICT_XLS_FILES.items():
             self.show_print("  %s" % file, [self.LOG_FILE])
         self.show_print("", [self.LOG_FILE])
 
-        del dict_xlsx_files[base_repository]
-        collection_base, dois_base = self.read_xls_summary(base_xlsx_file, self.XLS_SHEET_UNIQUE)
-
-        # Set base repository
-        for _, item in collection_base.items():
-            item.update({self.xls_col_repository: base_repository})
-
-        collect_duplicate = {}
-        collect_unique = {}
-        for secondary_repository, secondary_file in dict_xlsx_files.items():
-            # Load information
-            collection_secondary, dois_secondary = self.read_xls_summary(secondary_file, self.XLS_SHEET_UNIQUE)
-
-            # Get DOIs
-            dois_duplicate = list(set(dois_base) & set(dois_secondary))
-            dois_only_base = list(set(dois_base) - set(dois_secondary))
-            dois_only_secondary = list(set(dois_secondary) - set(dois_base))
-
-            # Get unique DOIs
-            collect_unique_doi = {}
-            index_u = 1
-            for _, item in collection_base.items():
-                doi = item[self.xls_col_doi]
-                if doi in dois_duplicate:
-                    repository = '%s/%s' % (item[self.xls_col_repository], secondary_repository)
-                    item.update({self.xls_col_repository: repository})
-
-                collect_unique_doi.update({index_u: item})
-                index_u += 1
-
-            index_r = len(collect_duplicate) + 1
-            index_u = len(collect_unique_doi) + 1
-            for _, item in collection_secondary.items():
-                doi = item[self.xls_col_doi]
-                item.update({self.xls_col_repository: secondary_repository})
-                if doi in dois_duplicate:
-                    item[self.xls_col_duplicate_type] = self.xls_val_by_doi
-                    collect_duplicate.update({index_r: item})
-                    index_r += 1
-
-                if doi in dois_only_secondary:
-                    collect_unique_doi.update({index_u: item})
-                    index_u += 1
-
-            # Get duplicate titles
-            nr_title = []
-            re_title = []
-            for _, row in collect_unique_doi.items():
-                flag_unique = False
+        # Load information
+        self.load_xls_files()
 
-                title = row[self.xls_col_title]
-                if title:
-                    title = title.strip().lower()
-                    if title not in nr_title:
-                        nr_title.append(title)
-                        flag_unique = True
-
-                    if not flag_unique:
-                        re_title.append(title)
-
-            # Get unique titles
-            nr_title_ctrl = {item: {'n_check': 0, 'is_valid': False, 'repository': None} for item in re_title}
-            index_u = 1
-            index_r = len(collect_duplicate) + 1
-            for _, row in collect_unique_doi.items():
-                flag_unique = False
+        state = None
+        hashes = {}
+        if self.STATE_FILE:
+            hashes = self.get_input_hashes()
+            state = self.load_merge_state(hashes)
+            if state is not None:
+                self.enrichment_results.update(state['enrichment'])
 
-                doi = row[self.xls_col_doi]
-                title = row[self.xls_col_title]
-                if title:
-                    title = title.strip().lower()
-
-                if title in re_title:
-                    _n_check = nr_title_ctrl[title]['n_check']
-                    _is_valid = nr_title_ctrl[title]['is_valid']
-                    _repository = nr_title_ctrl[title]['repository']
-
-                    status = False
-                    if not _is_valid:
-                        status = self.check_doi(doi)
-
-                    if status:
-                        flag_unique = True
-                        nr_title_ctrl[title].update({'is_valid': True})
-                    else:
-                        if _n_check == 1 and _is_valid is False:
-                            flag_unique = True # forced
-
-                    if _repository is None:
-                        _repository = row[self.xls_col_repository]
-
-                    if flag_unique:
-                        row[self.xls_col_repository] = '%s/%s' % (_repository, secondary_repository)
-                    else:
-                        row[self.xls_col_repository] = row[self.xls_col_repository].split('/')[-1] # secondary_repository
-
-                    nr_title_ctrl[title].update({'n_check': _n_check + 1})
-                    nr_title_ctrl[title].update({'repository': _repository})
-                else:
-                    flag_unique = True
+        merged = [repository for repository, _ in state['files']] if state else []
+        collections = {}
+        for repository in self.DICT_XLS_FILES.keys():
+            if repository not in merged:
+                collections.update({repository: self.xls_sheets[repository][self.XLS_SHEET_UNIQUE]})
 
-                if flag_unique:
-                    collect_unique.update({index_u: row})
-                    index_u += 1
-                else:
-                    row[self.xls_col_duplicate_type] = self.xls_val_by_title
-                    collect_duplicate.update({index_r: row})
-                    index_r += 1
+        if self.FUZZY_TITLES:
+            with self.stage('fuzzy_titles', sum([len(collection) for collection in collections.values()])):
+                self.join_fuzzy_titles(collections, state)
+
+        if self.WARM_CACHE:
+            with self.stage('warm_cache'):
+                self.warm_cache(collections)
 
-            # For other respositories
-            collection_base = collect_unique.copy()
-            dois_base = []
-            for _, item in collection_base.items():
-                dois_base.append(item[self.xls_col_doi])
+        output = self.merge_collections(collections, state)
+        if self.STATE_FILE:
+            self.merge_state['files'] = [(repository, hashes[repository]) for repository, _ in self.merge_state['files']]
 
-        return collect_unique, collect_duplicate
+        return output
 
     def get_sheet_data_complement(self, collection_duplicates):
-        collect_without_doi = {}
-        collect_duplicates = {}
-        index_wod = 1
-        index_dup = 1
-        for repository, file in self.DICT_XLS_FILES.items():
+        collect_without_doi = []
+        collect_duplicates = []
+        self.load_xls_files()
+        for repository in self.DICT_XLS_FILES.keys():
+            bit = self.get_repository_bit(repository)
+
             # Without DOIs
-            dict_without_doi, _ = self.read_xls_summary(file, self.XLS_SHEET_WITHOUT_DOI)
-            for _, item in dict_without_doi.items():
-                item.update({self.xls_col_repository: repository})
-                collect_without_doi.update({index_wod: item})
-                index_wod += 1
+            for item in self.xls_sheets[repository][self.XLS_SHEET_WITHOUT_DOI]:
+                item.repositories = bit
+                collect_without_doi.append(item)
 
             # Duplicates
-            dict_duplicates, _ = self.read_xls_summary(file, self.XLS_SHEET_DUPLICATES)
-            for _, item in dict_duplicates.items():
-                item.update({self.xls_col_repository: repository})
-                collect_duplicates.update({index_dup: item})
-                index_dup += 1
+            for item in self.xls_sheets[repository][self.XLS_SHEET_DUPLICATES]:
+                item.repositories = bit
+                collect_duplicates.append(item)
 
         # Join duplicates items
-        index = len(collection_duplicates) + 1
-        for _, item in collect_duplicates.items():
-            collection_duplicates.update({index: item})
-            index += 1
+        collection_duplicates.extend(collect_duplicates)
 
         return collect_without_doi, collection_duplicates
 
+    def get_input_hashes(self):
+        if self.input_hashes is None:
+            self.input_hashes = {repository: self.get_file_hash(file) for repository, file in self.DICT_XLS_FILES.items()}
+
+        return self.input_hashes
+
+    def get_checkpoint_key(self):
+        # A checkpoint is only valid for the same input files and options
+        return {'version': self.DATA_FORMAT,
+                'files': list(self.get_input_hashes().items()),
+                'fuzzy_titles': self.FUZZY_TITLES}
+
+    def save_checkpoint(self, collect_unique, collect_without_doi, collect_duplicates):
+        # Stage 1 done: the collections after removing duplicates
+        self.create_directory(self.CHECKPOINT_PATH)
+        checkpoint = {'key': self.get_checkpoint_key(),
+                      'merge_state': self.merge_state,
+                      'collections': (collect_unique, collect_without_doi, collect_duplicates)}
+        file = os.path.join(self.CHECKPOINT_PATH, self.NAME_CHECKPOINT_MERGE)
+        with open('%s.tmp' % file, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace('%s.tmp' % file, file)
+
+        # Stage 2 starts empty
+        open(os.path.join(self.CHECKPOINT_PATH, self.NAME_CHECKPOINT_ENRICHMENT), 'w').close()
+
+    def load_checkpoint(self):
+        # The collections of the last run and the Crossref results it already
+        # got, None if there is nothing to resume
+        file = os.path.join(self.CHECKPOINT_PATH, self.NAME_CHECKPOINT_MERGE)
+        if not os.path.exists(file):
+            self.show_print("Nothing to resume, starting over", [self.LOG_FILE], font = self.YELLOW)
+            return None
+
+        with open(file, 'rb') as f:
+            checkpoint = pickle.load(f)
+
+        if checkpoint['key'] != self.get_checkpoint_key():
+            self.show_print("Input files or options changed since the checkpoint, starting over", [self.LOG_FILE], font = self.YELLOW)
+            return None
+
+        n_results = 0
+        file = os.path.join(self.CHECKPOINT_PATH, self.NAME_CHECKPOINT_ENRICHMENT)
+        if os.path.exists(file):
+            with open(file, 'r', encoding = 'utf-8') as f:
+                for line in f:
+                    try:
+                        doi, result = json.loads(line)
+                    except ValueError as e:
+                        continue # Cut by the interruption
+                    self.enrichment_results.update({doi: tuple(result)})
+                    n_results += 1
+
+        self.merge_state = checkpoint['merge_state']
+        self.show_print("Resuming from the checkpoint: duplicates already removed, %s DOIs already looked up in Crossref" % n_results, [self.LOG_FILE], font = self.GREEN)
+        self.show_print("", [self.LOG_FILE])
+
+        return checkpoint['collections']
+
+    def checkpoint_enrichment(self, doi, result):
+        # Stage 2, one line per DOI as the results arrive
+        if self.CHECKPOINT_PATH is None or result is None:
+            return
+
+        if self.checkpoint_file is None:
+            self.create_directory(self.CHECKPOINT_PATH)
+            self.checkpoint_file = open(os.path.join(self.CHECKPOINT_PATH, self.NAME_CHECKPOINT_ENRICHMENT), 'a', encoding = 'utf-8')
+        self.checkpoint_file.write('%s\n' % json.dumps([doi, result]))
+        self.checkpoint_file.flush()
+
+    def remove_checkpoint(self):
+        # Stage 3 done: the output is written
+        if self.checkpoint_file is not None:
+            self.checkpoint_file.close()
+            self.checkpoint_file = None
+
+        for name in [self.NAME_CHECKPOINT_MERGE, self.NAME_CHECKPOINT_ENRICHMENT]:
+            file = os.path.join(self.CHECKPOINT_PATH, name)
+            if os.path.exists(file):
+                os.remove(file)
+        if os.path.isdir(self.CHECKPOINT_PATH) and not os.listdir(self.CHECKPOINT_PATH):
+            os.rmdir(self.CHECKPOINT_PATH)
+
+    def run(self):
+        # The whole pipeline for the input files already set, returns the
+        # output files and the counts
+        self.get_list_files()
+        self.show_print("#############################################################################", [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("############################# Remove Deplicates #############################", [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("#############################################################################", [self.LOG_FILE], font = self.BIGREEN)
+
+        self.CHECKPOINT_PATH = os.path.join(self.OUTPUT_PATH, self.NAME_CHECKPOINT)
+        collections = self.load_checkpoint() if self.RESUME else None
+        if collections:
+            collect_unique, collect_without_doi, collect_duplicates = collections
+        else:
+            collect_unique, collect_duplicate = self.get_sheet_data()
+            with self.stage('complement') as metrics:
+                collect_without_doi, collect_duplicates = self.get_sheet_data_complement(collect_duplicate)
+                metrics['records'] += len(collect_without_doi) + len(collect_duplicates)
+            self.save_checkpoint(collect_unique, collect_without_doi, collect_duplicates)
+
+        # Create summary file
+        with self.stage('enrichment', len(collect_unique)):
+            self.enrich_collection(collect_unique)
+        with self.stage('write', len(collect_unique) + len(collect_without_doi) + len(collect_duplicates)):
+            output_files = self.save_summary(collect_unique, collect_without_doi, collect_duplicates)
+        self.remove_checkpoint()
+        self.show_print("Output files:" if len(output_files) > 1 else "Output file: %s" % output_files[0], [self.LOG_FILE], font = self.GREEN)
+        if len(output_files) > 1:
+            for output_file in output_files:
+                self.show_print("  %s" % output_file, [self.LOG_FILE])
+        self.show_print("  Unique documents: %s" % len(collect_unique), [self.LOG_FILE])
+        self.show_print("  Duplicate documents: %s" % len(collect_duplicates), [self.LOG_FILE])
+        self.show_print("  Documents without DOI: %s" % len(collect_without_doi), [self.LOG_FILE])
+        counts = {'unique': len(collect_unique), 'duplicates': len(collect_duplicates), 'without_doi': len(collect_without_doi)}
+        if self.crossref_unverified:
+            self.show_print("  DOIs of duplicate titles not verified, Crossref unavailable: %s" % len(self.crossref_unverified), [self.LOG_FILE], font = self.YELLOW)
+            for doi in sorted(self.crossref_unverified):
+                self.show_print("    %s" % doi, [self.LOG_FILE], font = self.YELLOW)
+
+        self.save_merge_state()
+
+        return output_files, counts
+
+    def load_dataframes(self, exports):
+        # Repository -> DataFrame of its 'Unique' sheet, iterable of records,
+        # or {sheet: DataFrame or records}. Missing columns are left empty.
+        # The provenance is written in the order of the exports
+        self.REPOSITORIES = list(exports.keys()) + [repository for repository in self.REPOSITORIES if repository not in exports]
+        for repository, export in exports.items():
+            sheets = export if isinstance(export, dict) else {self.XLS_SHEET_UNIQUE: export}
+            collections = {}
+            for sheet in [self.XLS_SHEET_UNIQUE, self.XLS_SHEET_WITHOUT_DOI, self.XLS_SHEET_DUPLICATES]:
+                df = sheets.get(sheet)
+                if not isinstance(df, pd.DataFrame):
+                    df = pd.DataFrame(list(df) if df is not None else [], dtype = object)
+                df = df.reindex(columns = self.get_sheet_columns(sheet))
+                collections.update({sheet: self.get_records(self.read_xls_summary(df, sheet))})
+
+            self.DICT_XLS_FILES.update({repository: None})
+            self.xls_sheets.update({repository: collections})
+
+    def get_dataframe(self, sheet_type, records):
+        return pd.DataFrame([row for _, row in self.iter_sheet_rows(sheet_type, records)], columns = self.get_sheet_columns(sheet_type))
+
+    def dedup(self, exports, enrich = False):
+        # Same merge as run(), in memory. Returns {'Unique': DataFrame,
+        # 'Without DOI': DataFrame, 'Duplicates': DataFrame}
+        self.load_dataframes(exports)
+        try:
+            collect_unique, collect_duplicate = self.get_sheet_data()
+            with self.stage('complement') as metrics:
+                collect_without_doi, collect_duplicates = self.get_sheet_data_complement(collect_duplicate)
+                metrics['records'] += len(collect_without_doi) + len(collect_duplicates)
+            if enrich:
+                with self.stage('enrichment', len(collect_unique)):
+                    self.enrich_collection(collect_unique)
+        finally:
+            self.close_crossref()
+
+        return {self.XLS_SHEET_UNIQUE: self.get_dataframe(self.XLS_SHEET_UNIQUE, collect_unique),
+                self.XLS_SHEET_WITHOUT_DOI: self.get_dataframe(self.XLS_SHEET_WITHOUT_DOI, collect_without_doi),
+                self.XLS_SHEET_DUPLICATES: self.get_dataframe(self.XLS_SHEET_DUPLICATES, collect_duplicates)}
+
+class DedupService:
+
+    def __init__(self, orr, host = '127.0.0.1', port = 8750, workers = 1):
+        # Local HTTP service running jobs with the settings of orr, sharing its
+        # Crossref client, cache and the records already looked up
+        self.orr = orr
+        self.workers = max(1, workers)
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.get_handler())
+        self.server.daemon_threads = True
+        self.url = 'http://%s:%s' % self.server.server_address[:2]
+
+        # Options of a job, the rest are the ones the service was started with
+        self.job_options = {'output_format': 'OUTPUT_FORMATS',
+                            'fuzzy_titles': 'FUZZY_TITLES',
+                            'state': 'STATE_FILE',
+                            'enrich_budget': 'ENRICH_BUDGET',
+                            'enrich_max_requests': 'ENRICH_MAX_REQUESTS',
+                            'resume': 'RESUME'}
+
+    def serve(self):
+        for _ in range(self.workers):
+            threading.Thread(target = self.work, daemon = True).start()
+
+        self.orr.show_print("Dedup service listening on %s (%s workers)" % (self.url, self.workers), [self.orr.LOG_FILE], font = self.orr.GREEN)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt as e:
+            self.orr.show_print("Dedup service stopped", [self.orr.LOG_FILE])
+        finally:
+            self.server.server_close()
+
+    def submit(self, request):
+        # Checks a job and queues it, returns (HTTP status, answer)
+        files = request.get('files')
+        output = request.get('output')
+        options = request.get('options') or {}
+        if not files or not isinstance(files, list):
+            return 400, {'error': 'files: list of .xlsx files required'}
+        if not output:
+            return 400, {'error': 'output: output folder required'}
+        for file in files:
+            if not os.path.isfile(file):
+                return 400, {'error': "the file '%s' doesn't exist" % file}
+        for option in options:
+            if option not in self.job_options:
+                return 400, {'error': "unknown option '%s', choose from: %s" % (option, ', '.join(self.job_options))}
+        output_formats = options.get('output_format') or self.orr.OUTPUT_FORMATS
+        if isinstance(output_formats, str):
+            output_formats = [output_format.strip().lower() for output_format in output_formats.split(',') if output_format.strip()]
+        for output_format in output_formats:
+            if output_format not in self.orr.ALL_OUTPUT_FORMATS:
+                return 400, {'error': "unknown output format '%s', choose from: %s" % (output_format, ', '.join(self.orr.ALL_OUTPUT_FORMATS))}
+        options.update({'output_format': output_formats})
+
+        job = {'id': uuid.uuid4().hex[:12],
+               'status': 'queued',
+               'files': files,
+               'output': output,
+               'options': options,
+               'submitted': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with self.lock:
+            self.jobs.update({job['id']: job})
+        self.queue.put(job)
+
+        return 202, job
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.run_job(job)
+            finally:
+                self.queue.task_done()
+
+    def get_job_orr(self, job):
+        # The options of the service, not its input files
+        orr = RemoveDuplicate(crossref_client = self.orr.crossref_client)
+        for name, value in vars(self.orr).items():
+            if name.isupper() and not name.startswith('XLS_FILE_') and name not in ['INPUT_XLS_FILES', 'DICT_XLS_FILES', 'STATE_FILE', 'PROFILE_FILE', 'RESUME']:
+                setattr(orr, name, value)
+        orr.crossref_cache = self.orr.crossref_cache
+        orr.crossref_records = self.orr.crossref_records
+
+        for option, value in job['options'].items():
+            setattr(orr, self.job_options[option], value)
+        for file in job['files']:
+            orr.set_input_file(os.path.abspath(file))
+
+        orr.OUTPUT_PATH = os.path.abspath(job['output'])
+        orr.create_directory(orr.OUTPUT_PATH)
+        orr.LOG_FILE = os.path.join(orr.OUTPUT_PATH, orr.LOG_NAME)
+        orr.METRICS_FILE = '%s_%s_%s_metrics.json' % (os.path.splitext(orr.LOG_FILE)[0], time.strftime('%H%M%S'), job['id'])
+        orr.XLS_FILE_OUTPUT = os.path.join(orr.OUTPUT_PATH, os.path.basename(self.orr.XLS_FILE_OUTPUT))
+        orr.PARSE_CACHE_PATH = self.orr.PARSE_CACHE_PATH
+        # Jobs run in the threads of the service, a fork would copy the locks
+        # the other threads hold
+        orr.MP_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+        return orr
+
+    def run_job(self, job):
+        start = time.time()
+        with self.lock:
+            job.update({'status': 'running', 'started': time.strftime('%Y-%m-%d %H:%M:%S')})
+        counts = None
+        orr = None
+        status = 'failed'
+        result = {}
+        try:
+            orr = self.get_job_orr(job)
+            output_files, counts = orr.run()
+            status = 'done'
+            result.update({'output_files': output_files, 'counts': counts})
+        except Exception as e:
+            result.update({'error': traceback.format_exc()})
+        finally:
+            result.update({'finished': time.strftime('%Y-%m-%d %H:%M:%S'), 'elapsed_seconds': round(time.time() - start, 3)})
+            if orr:
+                if orr.checkpoint_file is not None:
+                    orr.checkpoint_file.close()
+                orr.metrics.update({'elapsed_seconds': result['elapsed_seconds']})
+                orr.save_metrics(status, counts)
+                result.update({'log_file': orr.LOG_FILE, 'metrics_file': orr.METRICS_FILE})
+            # The status last, clients read the job as soon as it's done
+            with self.lock:
+                job.update(result)
+                job.update({'status': status})
+
+    def get_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # POST /jobs, GET /jobs, GET /jobs/<id>, GET /health
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, code, data):
+                body = json.dumps(data, default = str).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.rstrip('/')
+                if path == '/health':
+                    with service.lock:
+                        statuses = [job['status'] for job in service.jobs.values()]
+                    return self.send(200, {'status': 'ok', 'version': service.orr.VERSION, 'queued': statuses.count('queued'), 'running': statuses.count('running')})
+                if path == '/jobs':
+                    with service.lock:
+                        return self.send(200, list(service.jobs.values()))
+                if path.startswith('/jobs/'):
+                    with service.lock:
+                        job = service.jobs.get(path[len('/jobs/'):])
+                        job = dict(job) if job else None
+                    if job:
+                        return self.send(200, job)
+                    return self.send(404, {'error': 'unknown job'})
+                self.send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/jobs':
+                    return self.send(404, {'error': 'not found'})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                except ValueError as e:
+                    return self.send(400, {'error': 'invalid JSON'})
+                self.send(*service.submit(request))
+
+        return Handler
+
+def remove_duplicates(exports, enrich = False, fuzzy_titles = None, crossref_client = None, crossref_url = None, mailto = None, concurrency = None, enrich_budget = None, enrich_max_requests = None):
+    # Library entry point, nothing is read from or written to disk and nothing
+    # is printed. exports is {repository: DataFrame or records} in merge order,
+    # the first one is the base. Crossref is still called to check the DOIs
+    # of duplicate titles, and to fill the missing fields if enrich is True
+    orr_api = RemoveDuplicate(crossref_client = crossref_client)
+    orr_api.QUIET = True
+    orr_api.USE_CACHE = False
+    orr_api.PARSE_CACHE_PATH = None
+    orr_api.FUZZY_TITLES = fuzzy_titles
+    orr_api.CROSSREF_URL = crossref_url or orr_api.CROSSREF_URL
+    orr_api.CROSSREF_MAILTO = mailto
+    orr_api.CROSSREF_WORKERS = concurrency or orr_api.CROSSREF_WORKERS
+    orr_api.ENRICH_BUDGET = enrich_budget
+    orr_api.ENRICH_MAX_REQUESTS = enrich_max_requests
+
+    return orr_api.dedup(exports, enrich)
+
+def read_xls_file(xlsfile, engine, parse_cache_path):
+    # Entry point of the worker processes
+    orr_worker = RemoveDuplicate()
+    orr_worker.XLS_ENGINE = engine
+    orr_worker.PARSE_CACHE_PATH = parse_cache_path
+    return orr_worker.read_xls_file(xlsfile)
+
 def main():
+    status = 'failed'
+    counts = None
+    profiler = None
     try:
         start = orr.start_time()
         menu()
@@ -874,28 +2623,43 @@ def main():
         orr.LOG_FILE = os.path.join(orr.OUTPUT_PATH, orr.LOG_NAME)
         orr.XLS_FILE_OUTPUT = os.path.join(orr.OUTPUT_PATH, orr.XLS_FILE_OUTPUT)
         orr.create_directory(orr.OUTPUT_PATH)
-        orr.get_list_files()
-        orr.show_print("#############################################################################", [orr.LOG_FILE], font = orr.BIGREEN)
-        orr.show_print("############################# Remove Deplicates #############################", [orr.LOG_FILE], font = orr.BIGREEN)
-        orr.show_print("#############################################################################", [orr.LOG_FILE], font = orr.BIGREEN)
-
-        collect_unique, collect_duplicate = orr.get_sheet_data()
-        collect_without_doi, collect_duplicates = orr.get_sheet_data_complement(collect_duplicate)
-
-        # Create summary file
-        orr.save_xls(collect_unique, collect_without_doi, collect_duplicates)
-        orr.show_print("Output file: %s" % orr.XLS_FILE_OUTPUT, [orr.LOG_FILE], font = orr.GREEN)
-        orr.show_print("  Unique documents: %s" % len(collect_unique), [orr.LOG_FILE])
-        orr.show_print("  Duplicate documents: %s" % len(collect_duplicates), [orr.LOG_FILE])
-        orr.show_print("  Documents without DOI: %s" % len(collect_without_doi), [orr.LOG_FILE])
-
+        if orr.SERVE:
+            orr.open_crossref()
+            DedupService(orr, orr.SERVE_HOST, orr.SERVE_PORT, orr.SERVE_WORKERS).serve()
+            orr.close_crossref()
+            return
+
+        orr.METRICS_FILE = '%s_%s_metrics.json' % (os.path.splitext(orr.LOG_FILE)[0], time.strftime('%H%M%S'))
+        if orr.TRACE_MEMORY:
+            tracemalloc.start()
+        if orr.PROFILE_FILE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        orr.open_crossref()
+        output_files, counts = orr.run()
+        orr.close_crossref()
+
+        status = 'done'
         orr.show_print("", [orr.LOG_FILE])
         orr.show_print(orr.finish_time(start, "Elapsed time"), [orr.LOG_FILE])
         orr.show_print("Done!", [orr.LOG_FILE])
+    except KeyboardInterrupt as e:
+        status = 'interrupted'
+        orr.close_crossref()
+        orr.show_print("\nInterrupted, run it again with --resume to continue", [orr.LOG_FILE], font = orr.YELLOW)
+        orr.show_print(orr.finish_time(start, "Elapsed time"), [orr.LOG_FILE])
     except Exception as e:
+        orr.close_crossref()
         orr.show_print("\n%s" % traceback.format_exc(), [orr.LOG_FILE], font = orr.RED)
         orr.show_print(orr.finish_time(start, "Elapsed time"), [orr.LOG_FILE])
         orr.show_print("Done!", [orr.LOG_FILE])
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(orr.PROFILE_FILE)
+        if orr.METRICS_FILE:
+            orr.metrics.update({'elapsed_seconds': round(time.time() - start, 3)})
+            orr.save_metrics(status, counts)
 
 if __name__ == '__main__':
     orr = RemoveDuplicate()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+
+def menu():
+    parser = argparse.ArgumentParser(description = "Sends a job to the service started with 'remove_duplicates.py --serve' and waits for its results. Only the standard library is imported, the service already has everything loaded.", epilog = "Thank you!")
+    parser.add_argument("-f", "--files", help = ".xlsx files separated by comma")
+    parser.add_argument("-o", "--output", help = "Output folder (default: output_remove_duplicate)")
+    parser.add_argument("--server", default = rdc.SERVER, help = "Address of the service (default: %s)" % rdc.SERVER)
+    parser.add_argument("--output-format", metavar = "FORMATS", help = "Output formats separated by comma (default: the ones of the service)")
+    parser.add_argument("--fuzzy-titles", metavar = "THRESHOLD", nargs = "?", type = float, const = rdc.FUZZY_THRESHOLD, help = "Also join near-duplicate titles (default: %s)" % rdc.FUZZY_THRESHOLD)
+    parser.add_argument("--state", metavar = "FILE", help = "Dedup index of the project")
+    parser.add_argument("--enrich-budget", metavar = "SECONDS", type = float, help = "Stop getting additional information from Crossref after this time")
+    parser.add_argument("--enrich-max-requests", metavar = "N", type = int, help = "Maximum number of DOIs looked up in Crossref to fill the missing fields")
+    parser.add_argument("--resume", action = "store_true", help = "Continue an interrupted run from its checkpoint in the output folder")
+    parser.add_argument("--no-wait", action = "store_true", help = "Only send the job and show its id")
+    parser.add_argument("--status", metavar = "JOB", help = "Show the status of a job")
+    parser.add_argument("--jobs", action = "store_true", help = "Show the jobs of the service")
+
+    args = parser.parse_args()
+    if not args.files and not args.status and not args.jobs:
+        parser.error("the following arguments are required: -f/--files")
+
+    rdc.SERVER = args.server.rstrip('/')
+    if not rdc.SERVER.startswith('http'):
+        rdc.SERVER = 'http://%s' % rdc.SERVER
+    rdc.WAIT = not args.no_wait
+    rdc.STATUS = args.status
+    rdc.LIST_JOBS = args.jobs
+
+    if args.files:
+        # Absolute paths, the service may run in another folder
+        rdc.FILES = [os.path.abspath(file) for file in args.files.split(',') if file]
+        rdc.OUTPUT = os.path.abspath(args.output or 'output_remove_duplicate')
+
+        if args.output_format:
+            rdc.OPTIONS.update({'output_format': args.output_format})
+        if args.fuzzy_titles:
+            rdc.OPTIONS.update({'fuzzy_titles': args.fuzzy_titles})
+        if args.state:
+            rdc.OPTIONS.update({'state': os.path.abspath(args.state)})
+        if args.enrich_budget is not None:
+            rdc.OPTIONS.update({'enrich_budget': args.enrich_budget})
+        if args.enrich_max_requests is not None:
+            rdc.OPTIONS.update({'enrich_max_requests': args.enrich_max_requests})
+        if args.resume:
+            rdc.OPTIONS.update({'resume': True})
+
+class RemoveDuplicateClient:
+
+    def __init__(self):
+        self.SERVER = 'http://127.0.0.1:8750'
+        self.FUZZY_THRESHOLD = 0.85
+        self.FILES = []
+        self.OUTPUT = None
+        self.OPTIONS = {}
+        self.WAIT = True
+        self.STATUS = None
+        self.LIST_JOBS = False
+        self.POLL_INTERVAL = 0.1 # Seconds, doubled up to POLL_MAX_INTERVAL
+        self.POLL_MAX_INTERVAL = 2
+
+    def request(self, path, data = None):
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        request = urllib.request.Request('%s%s' % (self.SERVER, path), data = body, headers = {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            answer = json.loads(e.read() or b'{}')
+            raise RuntimeError(answer.get('error', 'HTTP %s' % e.code))
+
+    def submit(self):
+        return self.request('/jobs', {'files': self.FILES, 'output': self.OUTPUT, 'options': self.OPTIONS})
+
+    def wait(self, job_id):
+        interval = self.POLL_INTERVAL
+        while True:
+            job = self.request('/jobs/%s' % job_id)
+            if job['status'] in ['done', 'failed']:
+                return job
+            time.sleep(interval)
+            interval = min(interval * 2, self.POLL_MAX_INTERVAL)
+
+    def show_job(self, job):
+        print("Job %s: %s" % (job['id'], job['status']))
+        if job['status'] == 'done':
+            print("Output files:")
+            for output_file in job['output_files']:
+                print("  %s" % output_file)
+            print("  Unique documents: %s" % job['counts']['unique'])
+            print("  Duplicate documents: %s" % job['counts']['duplicates'])
+            print("  Documents without DOI: %s" % job['counts']['without_doi'])
+            print("Elapsed time: %.2fs" % job['elapsed_seconds'])
+        elif job['status'] == 'failed':
+            print(job['error'])
+        if job.get('log_file'):
+            print("Log: %s" % job['log_file'])
+
+def main():
+    try:
+        menu()
+        if rdc.LIST_JOBS:
+            for job in rdc.request('/jobs'):
+                print("%s  %-8s  %s  %s" % (job['id'], job['status'], job['submitted'], job['output']))
+        elif rdc.STATUS:
+            rdc.show_job(rdc.request('/jobs/%s' % rdc.STATUS))
+        else:
+            job = rdc.submit()
+            if rdc.WAIT:
+                job = rdc.wait(job['id'])
+            rdc.show_job(job)
+            if job['status'] == 'failed':
+                sys.exit(1)
+    except urllib.error.URLError as e:
+        print("%s: error: the service isn't running at %s (%s)" % (os.path.basename(__file__), rdc.SERVER, e.reason))
+        sys.exit(1)
+    except RuntimeError as e:
+        print("%s: error: %s" % (os.path.basename(__file__), e))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    rdc = RemoveDuplicateClient()
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+import pytest
+import benchmark
+import remove_duplicates as rd
+
+class OfflineCrossref:
+    # Crossref client answering every DOI as unknown, check_doi is stubbed
+    def works(self, dois, fields = None, stats = None, deadline = None):
+        return {}
+
+    def work(self, doi, stats = None, deadline = None):
+        return None
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def new_orr():
+    def make(exports = None, check_doi = None):
+        orr = rd.RemoveDuplicate(crossref_client = OfflineCrossref())
+        orr.QUIET = True
+        orr.USE_CACHE = False
+        if exports is not None:
+            orr.load_dataframes(exports)
+        if check_doi is not None:
+            orr.check_doi = check_doi
+        return orr
+    return make
+
+@pytest.fixture
+def crossref():
+    # Local stand-ins for Crossref, see benchmark.MockCrossref
+    mocks = []
+    def make(**kwargs):
+        mock = benchmark.MockCrossref(**kwargs).start()
+        mocks.append(mock)
+        return mock
+    yield make
+    for mock in mocks:
+        mock.stop()
+
+@pytest.fixture
+def write_exports():
+    # Synthetic formatted exports of the benchmark, input_scopus.xlsx, ...
+    def write(folder, size = 200, repositories = 3, seed = 1):
+        os.makedirs(folder, exist_ok = True)
+        bmk = benchmark.Benchmark()
+        bmk.REPOSITORIES = repositories
+        bmk.SEED = seed
+        return bmk.generate_exports(str(folder), size)
+    return write
+
+@pytest.fixture
+def run_cli():
+    # remove_duplicates.py in its own process, returns what it printed and the
+    # sheets of the summary
+    def run(files, output_path, *args):
+        process = subprocess.run([sys.executable, os.path.join(ROOT, 'remove_duplicates.py'), '-f', ','.join(files), '-o', str(output_path)] + list(args), capture_output = True, text = True)
+        assert process.returncode == 0 and 'Traceback' not in process.stdout, process.stdout + process.stderr
+        summary = os.path.join(output_path, 'summary_screened.xlsx')
+        sheets = pd.read_excel(summary, sheet_name = None) if os.path.exists(summary) else None
+        return process.stdout, sheets
+    return run
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+import remove_duplicates as rd
+from test_dois import VARIANTS
+from test_parse_cache import write_workbook
+from test_state import assert_same_sheets
+
+def read_exports(files):
+    # {repository: {sheet: DataFrame}} in the merge order of the CLI
+    orr = rd.RemoveDuplicate()
+    for file in files:
+        orr.set_input_file(file)
+    orr.get_list_files()
+    return {repository: pd.read_excel(file, sheet_name = None) for repository, file in orr.DICT_XLS_FILES.items()}
+
+def as_written(results, tmp_path):
+    # The returned DataFrames as the CLI writes them, read back from a workbook
+    file = tmp_path / 'api.xlsx'
+    with pd.ExcelWriter(file) as writer:
+        for sheet, df in results.items():
+            df.to_excel(writer, sheet_name = sheet, index = False)
+    return pd.read_excel(file, sheet_name = None)
+
+@pytest.mark.parametrize('records', [False, True])
+def test_api_matches_the_cli(tmp_path, crossref, write_exports, run_cli, records):
+    files = write_exports(tmp_path / 'input')
+    mock = crossref()
+    _, expected = run_cli(files, tmp_path / 'cli', '--crossref-url', mock.url, '--no-cache')
+
+    exports = read_exports(files)
+    if records:
+        exports = {repository: {sheet: df.to_dict('records') for sheet, df in sheets.items()} for repository, sheets in exports.items()}
+    results = rd.remove_duplicates(exports, enrich = True, crossref_url = mock.url)
+
+    assert list(results.keys()) == ['Unique', 'Without DOI', 'Duplicates']
+    assert all(isinstance(df, pd.DataFrame) for df in results.values())
+    assert_same_sheets(as_written(results, tmp_path), expected)
+
+def test_api_matches_the_cli_with_doi_variants(tmp_path, crossref, run_cli):
+    # The same work in each repository with its DOI written differently
+    orr = rd.RemoveDuplicate()
+    names = [orr.NAME_XLS_FILE_SCOPUS, orr.NAME_XLS_FILE_WOS, orr.NAME_XLS_FILE_PUBMED]
+    files = []
+    for index, (name, doi) in enumerate(zip(names, VARIANTS[1:])):
+        file = str(tmp_path / name)
+        write_workbook(orr, file, [{'Title': 'Shared work', 'DOI': doi, 'Year': 2020},
+                                   {'Title': 'Work %s' % index, 'DOI': '10.1000/own.%s' % index, 'Year': 2021}])
+        files.append(file)
+    mock = crossref()
+    _, expected = run_cli(files, tmp_path / 'cli', '--crossref-url', mock.url, '--no-cache')
+
+    results = rd.remove_duplicates(read_exports(files), enrich = True, crossref_url = mock.url)
+
+    assert len(results['Unique']) == 4
+    assert results['Duplicates']['DOI'].tolist() == VARIANTS[2:4]
+    assert_same_sheets(as_written(results, tmp_path), expected)
@@ -0,0 +1,54 @@
+import time
+
+import remove_duplicates as rd
+
+def test_ttl_expiry(tmp_path):
+    cache = rd.CrossrefCache(str(tmp_path / 'crossref_cache.sqlite'), ttl = 60)
+    cache.put('10.1/a', {'title': 'A'})
+    cache.put('10.1/b', None)
+    assert cache.get('10.1/a') == (True, {'title': 'A'})
+    assert cache.get('10.1/b') == (True, None)
+
+    # Saved two minutes ago
+    cache.connection.execute("UPDATE works SET created = created - 120 WHERE doi = '10.1/a'")
+    assert cache.get('10.1/a') == (False, None)
+    assert cache.get('10.1/b') == (True, None)
+    cache.evict()
+    assert cache.connection.execute("SELECT doi FROM works").fetchall() == [('10.1/b',)]
+    cache.close()
+
+def test_ttl_zero_always_fetches_again(tmp_path):
+    cache = rd.CrossrefCache(str(tmp_path / 'crossref_cache.sqlite'), ttl = 0)
+    cache.put('10.1/a', {'title': 'A'})
+    assert cache.get('10.1/a') == (False, None)
+    cache.close()
+
+def test_lru_eviction(tmp_path):
+    cache = rd.CrossrefCache(str(tmp_path / 'crossref_cache.sqlite'), max_entries = 2)
+    for doi in ['10.1/a', '10.1/b', '10.1/c']:
+        cache.put(doi, {'title': doi})
+        time.sleep(0.01)
+    cache.get('10.1/a')
+    cache.evict()
+
+    # The least recently used one goes
+    assert sorted(cache.connection.execute("SELECT doi FROM works").fetchall()) == [('10.1/a',), ('10.1/c',)]
+    cache.close()
+
+def test_cache_reused_across_runs(tmp_path, new_orr, crossref):
+    mock = crossref()
+    dois = ['10.1/%s' % i for i in range(6)]
+    checks = []
+    for _ in range(2):
+        orr = new_orr()
+        orr.USE_CACHE = True
+        orr.OUTPUT_PATH = str(tmp_path)
+        orr.crossref_client = rd.CrossrefClient(mock.url, backoff = 0.01)
+        orr.open_crossref()
+        checks.append([orr.check_doi(doi) for doi in dois])
+        orr.close_crossref()
+        orr.crossref_client.close()
+
+    # Known and unknown DOIs, none of them asked again
+    assert checks[0] == checks[1] and True in checks[0] and False in checks[0]
+    assert mock.stats['single'] == len(dois)
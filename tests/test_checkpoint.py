@@ -0,0 +1,61 @@
+import os
+import json
+
+import pytest
+
+import remove_duplicates as rd
+from test_state import assert_same_sheets
+
+def run_until_failure(files, output_path, mock, n_results):
+    # The pipeline of the CLI in this process, failing in the enrichment stage
+    # after n_results Crossref results were saved in the checkpoint
+    orr = rd.RemoveDuplicate()
+    orr.QUIET = True
+    orr.USE_CACHE = False
+    orr.CROSSREF_URL = mock.url
+    for file in files:
+        orr.set_input_file(file)
+    orr.OUTPUT_PATH = str(output_path)
+    orr.create_directory(orr.OUTPUT_PATH)
+    orr.LOG_FILE = os.path.join(orr.OUTPUT_PATH, orr.LOG_NAME)
+    orr.XLS_FILE_OUTPUT = os.path.join(orr.OUTPUT_PATH, orr.XLS_FILE_OUTPUT)
+    orr.PARSE_CACHE_PATH = os.path.join(orr.OUTPUT_PATH, orr.NAME_PARSE_CACHE)
+
+    checkpoint_enrichment = orr.checkpoint_enrichment
+    saved = []
+    def failing_checkpoint_enrichment(doi, result):
+        checkpoint_enrichment(doi, result)
+        if result is not None:
+            saved.append(doi)
+        if len(saved) == n_results:
+            raise RuntimeError('Interrupted')
+    orr.checkpoint_enrichment = failing_checkpoint_enrichment
+
+    orr.open_crossref()
+    with pytest.raises(RuntimeError, match = 'Interrupted'):
+        orr.run()
+    orr.close_crossref()
+    orr.checkpoint_file.close()
+
+def test_resume_after_a_failure_in_the_enrichment(tmp_path, crossref, write_exports, run_cli):
+    files = write_exports(tmp_path / 'input')
+    mock = crossref()
+    _, one_shot = run_cli(files, tmp_path / 'one_shot', '--crossref-url', mock.url, '--no-cache')
+
+    output_path = tmp_path / 'resumed'
+    run_until_failure(files, output_path, mock, 10)
+    checkpoint_path = output_path / 'checkpoint'
+    assert sorted(os.listdir(checkpoint_path)) == ['enrichment.jsonl', 'merge.pkl']
+    with open(checkpoint_path / 'enrichment.jsonl', encoding = 'utf-8') as f:
+        saved = [json.loads(line)[0] for line in f]
+    assert len(saved) == 10
+
+    mock.reset()
+    output, resumed = run_cli(files, output_path, '--crossref-url', mock.url, '--no-cache', '--resume')
+
+    assert 'Resuming from the checkpoint: duplicates already removed, 10 DOIs already looked up in Crossref' in output
+    assert_same_sheets(resumed, one_shot)
+    # Only the enrichment is done again, without the DOIs already saved
+    assert mock.stats['single'] + mock.stats['batch'] > 0
+    assert {doi.lower() for doi in saved} & {doi.lower() for doi in mock.requested} == set()
+    assert not os.path.exists(checkpoint_path)
@@ -0,0 +1,194 @@
+import time
+import zlib
+
+import pytest
+import requests
+
+import remove_duplicates as rd
+
+def get_dois(n, known = True, start = 0):
+    # The stand-in doesn't know one DOI in three, always the same ones
+    dois = []
+    i = start
+    while len(dois) < n:
+        doi = '10.1/%s' % i
+        if (zlib.crc32(doi.encode()) % 3 != 0) == known:
+            dois.append(doi)
+        i += 1
+    return dois
+
+@pytest.fixture
+def crossref_orr(new_orr, tmp_path):
+    orrs = []
+    def make(mock, **kwargs):
+        orr = new_orr()
+        orr.crossref_client = rd.CrossrefClient(mock.url, backoff = 0.01, **kwargs)
+        orr.crossref_cache = rd.CrossrefCache(str(tmp_path / 'crossref_cache.sqlite'))
+        orrs.append(orr)
+        return orr
+    yield make
+    for orr in orrs:
+        orr.crossref_client.close()
+        orr.close_crossref()
+
+def test_batch_hits(crossref, crossref_orr):
+    mock = crossref()
+    orr = crossref_orr(mock)
+    dois = get_dois(4)
+    orr.prefetch_crossref(dois, progress = False)
+
+    assert mock.stats['batch'] == 1
+    assert [orr.check_doi(doi) for doi in dois] == [True] * 4
+    assert mock.stats['single'] == 0
+
+def test_batch_misses_are_looked_up_one_by_one(crossref, crossref_orr):
+    # A DOI the filter didn't return isn't unknown until /works/{doi} says so
+    hidden, known = get_dois(2)
+    unknown = get_dois(1, known = False)[0]
+    mock = crossref(batch_misses = [hidden])
+    orr = crossref_orr(mock)
+    orr.prefetch_crossref([known, hidden, unknown], progress = False)
+
+    assert mock.stats['batch'] == 1
+    assert orr.crossref_cache.get(hidden) == (False, None)
+    assert orr.crossref_cache.get(unknown) == (False, None)
+
+    assert [orr.check_doi(doi) for doi in [known, hidden, unknown]] == [True, True, False]
+    assert mock.stats['single'] == 2
+    assert orr.crossref_cache.get(hidden)[0] is True
+    assert orr.crossref_cache.get(unknown) == (True, None)
+
+def test_batch_failure(crossref, crossref_orr):
+    mock = crossref(error_rate = 1)
+    orr = crossref_orr(mock, retries = 0)
+    dois = get_dois(3)
+    orr.prefetch_crossref(dois, progress = False)
+
+    assert mock.stats['errors'] == 1
+    assert orr.crossref_records == {}
+    assert [orr.crossref_cache.get(doi) for doi in dois] == [(False, None)] * 3
+
+    mock.error_rate = 0
+    assert [orr.check_doi(doi) for doi in dois] == [True] * 3
+    assert mock.stats['single'] == 3
+
+def test_rate_limit_headers(crossref):
+    # Requests spaced by the X-Rate-Limit headers, X-Concurrency-Limit at once
+    mock = crossref(rate_limit = 20, concurrency_limit = 2)
+    client = rd.CrossrefClient(mock.url)
+    dois = get_dois(6)
+    client.work(dois[0])
+
+    assert client.interval == pytest.approx(1 / 20)
+    assert client.concurrency == 2
+    start = time.perf_counter()
+    for doi in dois[1:]:
+        client.work(doi)
+    assert time.perf_counter() - start >= 4 / 20
+    client.close()
+
+def test_backoff_bounds():
+    client = rd.CrossrefClient('http://127.0.0.1', backoff = 1)
+    for attempt in range(5):
+        delays = [client.get_delay(attempt) for _ in range(200)]
+        assert 2 ** attempt / 2 <= min(delays) and max(delays) <= 2 ** attempt
+        assert len(set(delays)) > 1 # Jitter
+
+    # Retry-After only when longer than the backoff
+    response = requests.Response()
+    response.status_code = 429
+    response.headers.update({'Retry-After': '30'})
+    assert client.get_delay(0, response) == 30
+    response.headers.update({'Retry-After': '0'})
+    assert client.get_delay(0, response) <= 1
+    client.close()
+
+def test_retries_with_backoff(crossref):
+    mock = crossref(error_rate = 1)
+    client = rd.CrossrefClient(mock.url, retries = 3, backoff = 0.05, breaker_failures = 10)
+    start = time.perf_counter()
+    with pytest.raises(rd.CrossrefUnavailable):
+        client.work(get_dois(1)[0])
+    elapsed = time.perf_counter() - start
+
+    assert mock.stats['errors'] == 4
+    assert client.stats == {'requests': 4, 'retries': 3, 'throttled': 0, 'failed': 1, 'single_lookups': 1}
+    # Three waits of half to all of 0.05, 0.1 and 0.2 seconds
+    assert 0.175 <= elapsed < 0.35 + 0.5
+    client.close()
+
+def test_throttled_requests_wait_retry_after(crossref):
+    mock = crossref(throttle_rate = 1, retry_after = 0.3)
+    client = rd.CrossrefClient(mock.url, retries = 2, backoff = 0.01, breaker_failures = 1)
+    start = time.perf_counter()
+    with pytest.raises(rd.CrossrefUnavailable):
+        client.work(get_dois(1)[0])
+
+    assert time.perf_counter() - start >= 2 * 0.3
+    assert mock.stats['throttled'] == 3
+    assert client.stats == {'requests': 3, 'retries': 2, 'throttled': 2, 'failed': 1, 'single_lookups': 1}
+    # Throttled, not failing: the breaker stays closed
+    assert client.open_until == 0
+    client.close()
+
+def test_breaker_opens_and_recovers(crossref):
+    mock = crossref(latency = 0.5)
+    client = rd.CrossrefClient(mock.url, timeout = 0.1, retries = 0, breaker_failures = 2, breaker_cooldown = 0.5)
+    doi = get_dois(1)[0]
+    for _ in range(2):
+        with pytest.raises(rd.CrossrefUnavailable):
+            client.work(doi)
+
+    # Open: no request is made until the cooldown has passed
+    with pytest.raises(rd.CrossrefUnavailable, match = 'circuit breaker open'):
+        client.work(doi)
+    assert client.stats['requests'] == 2
+
+    # Half-open: one request goes through, a failure opens it again
+    time.sleep(0.5)
+    with pytest.raises(rd.CrossrefUnavailable):
+        client.work(doi)
+    with pytest.raises(rd.CrossrefUnavailable, match = 'circuit breaker open'):
+        client.work(doi)
+    assert client.stats['requests'] == 3
+
+    # A success closes it
+    mock.latency = 0
+    time.sleep(0.5)
+    assert client.work(doi)['DOI'] == doi
+    assert client.failures == 0
+    assert client.work(doi)['DOI'] == doi
+    client.close()
+
+def test_unavailable_crossref_leaves_rows_for_the_next_run(crossref, crossref_orr):
+    # Slower than the timeout: the breaker opens, the DOIs aren't taken as
+    # unknown and the rows are left un-enriched, not filled with nothing
+    mock = crossref(latency = 0.5)
+    orr = crossref_orr(mock, timeout = 0.1, retries = 0, breaker_failures = 2, breaker_cooldown = 60)
+    dois = get_dois(4)
+    records = [rd.Record('Title %s' % doi, None, None, doi, None, None, None, None, 'title %s' % doi, doi) for doi in dois]
+
+    assert orr.check_doi(dois[0]) is None
+    assert orr.crossref_unverified == {dois[0]}
+    assert orr.get_complement(dois[1]) is None
+    orr.enrich_collection(records)
+
+    assert [item.abstract for item in records] == [None] * 4
+    assert orr.enrichment_results == {}
+    assert [orr.crossref_cache.get(doi) for doi in dois] == [(False, None)] * 4
+
+def test_metrics_count_the_requests_sent(crossref, crossref_orr):
+    # The DOIs checked after the breaker opened are not lookups
+    mock = crossref(latency = 0.5)
+    orr = crossref_orr(mock, timeout = 0.1, retries = 0, breaker_failures = 2, breaker_cooldown = 60)
+    with orr.stage('title_resolution'):
+        for doi in get_dois(4):
+            orr.check_doi(doi)
+
+    assert orr.metrics['stages']['title_resolution']['crossref'] == {'doi_checks': 4, 'single_lookups': 2, 'requests': 2, 'failed': 2}
+
+    mock.latency = 0
+    orr = crossref_orr(mock)
+    with orr.stage('enrichment'):
+        orr.prefetch_crossref(get_dois(4), progress = False)
+    assert orr.metrics['stages']['enrichment']['crossref'] == {'batch_lookups': 1, 'batch_dois': 4, 'requests': 1}
@@ -0,0 +1,22 @@
+VARIANTS = ['10.1000/Abc.1',
+            'https://doi.org/10.1000/abc.1',
+            'http://dx.doi.org/10.1000/ABC.1',
+            'doi: 10.1000/abc.1',
+            '  10.1000/abc.1  ',
+            '10.1000/abc.1.',
+            '10.1000/abc.1;']
+
+def test_doi_variants_have_the_same_key(new_orr):
+    orr = new_orr({'Scopus': [{'Title': 'Title %s' % i, 'DOI': doi} for i, doi in enumerate(VARIANTS)]})
+
+    assert {item.doi_key for item in orr.xls_sheets['Scopus'][orr.XLS_SHEET_UNIQUE]} == {'10.1000/abc.1'}
+
+def test_doi_variants_are_one_doi_duplicate(new_orr):
+    repositories = ['Scopus', 'Web of Science', 'PubMed', 'PubMed Central', 'Dimensions', 'Cochrane', 'Embase']
+    exports = {repository: [{'Title': 'Title in %s' % repository, 'DOI': doi}] for repository, doi in zip(repositories, VARIANTS)}
+    orr = new_orr(exports)
+    collect_unique, collect_duplicate = orr.get_sheet_data()
+
+    # The first one is kept, with the original DOI of each record
+    assert [(item.doi, orr.get_repositories(item.repositories)) for item in collect_unique] == [(VARIANTS[0], '/'.join(repositories))]
+    assert [(item.doi, item.duplicate_type) for item in collect_duplicate] == [(doi, orr.xls_val_by_doi) for doi in VARIANTS[1:]]
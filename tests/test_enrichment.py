@@ -0,0 +1,67 @@
+import threading
+import time
+
+import remove_duplicates as rd
+
+class SlowCrossref:
+    # Batch requests taking longer than the budget, finding half of the DOIs
+    def __init__(self, delay):
+        self.delay = delay
+        self.single_lookups = []
+        self.lock = threading.Lock()
+
+    def works(self, dois, fields = None, stats = None, deadline = None):
+        time.sleep(self.delay)
+        return {doi: {'DOI': doi, 'abstract': 'Abstract'} for doi in dois[::2]}
+
+    def work(self, doi, stats = None, deadline = None):
+        with self.lock:
+            self.single_lookups.append(doi)
+        time.sleep(self.delay)
+        return None
+
+    def close(self):
+        pass
+
+def test_budget_spent_in_batches_starts_no_single_lookups(new_orr):
+    orr = new_orr()
+    orr.crossref_client = SlowCrossref(0.3)
+    orr.ENRICH_BUDGET = 0.1
+    records = [rd.Record('Title %s' % i, None, None, '10.1/%s' % i, None, None, None, None, 'title %s' % i, '10.1/%s' % i) for i in range(10)]
+
+    orr.enrich_collection(records)
+
+    assert orr.crossref_client.single_lookups == []
+    assert [item.abstract for item in records] == ['Abstract', None] * 5
+
+def enrich_within_budget(orr, budget):
+    orr.ENRICH_BUDGET = budget
+    records = [rd.Record('Title %s' % i, None, None, '10.1/%s' % i, None, None, None, None, 'title %s' % i, '10.1/%s' % i) for i in range(10)]
+    start = time.perf_counter()
+    orr.enrich_collection(records)
+    return time.perf_counter() - start, records
+
+def test_budget_cuts_the_requests_already_running(new_orr, crossref):
+    # A batch request slower than the budget is cut when the budget runs out,
+    # and that doesn't count as a failure of Crossref
+    mock = crossref(latency = 2)
+    orr = new_orr()
+    orr.crossref_client = rd.CrossrefClient(mock.url, timeout = 30)
+    elapsed, records = enrich_within_budget(orr, 0.3)
+
+    assert elapsed < 0.3 + 0.5
+    assert [item.abstract for item in records] == [None] * 10
+    assert orr.enrichment_results == {}
+    assert orr.crossref_client.failures == 0
+    orr.crossref_client.close()
+
+def test_budget_stops_the_retries(new_orr, crossref):
+    # No backoff sleep past the budget
+    mock = crossref(error_rate = 1)
+    orr = new_orr()
+    orr.crossref_client = rd.CrossrefClient(mock.url, retries = 4, backoff = 1, breaker_failures = 100)
+    elapsed, records = enrich_within_budget(orr, 0.5)
+
+    assert elapsed < 0.5 + 0.5
+    assert [item.abstract for item in records] == [None] * 10
+    orr.crossref_client.close()
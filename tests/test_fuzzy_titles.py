@@ -0,0 +1,25 @@
+import pytest
+
+@pytest.fixture
+def get_keys(new_orr):
+    orr = new_orr()
+    orr.FUZZY_TITLES = orr.FUZZY_THRESHOLD
+    return orr.get_fuzzy_title_keys
+
+def test_subtitle_joins_the_title(get_keys):
+    keys = get_keys(['machine learning in medicine', 'Machine learning in medicine: a review'])
+    assert len(set(keys.values())) == 1
+
+def test_numbered_parts_are_not_joined(get_keys):
+    for titles in [['x', 'x: part 1', 'x: part 2'],
+                   ['machine learning in medicine', 'machine learning in medicine: part 1', 'machine learning in medicine: part 2']]:
+        keys = get_keys(titles)
+        assert len(set(keys.values())) == 3, keys
+
+def test_titles_sharing_a_head_are_not_joined(get_keys):
+    keys = get_keys(['machine learning in medicine: a review', 'machine learning in medicine: a survey', 'machine learning in medicine'])
+    assert len(set(keys.values())) == 3, keys
+
+def test_small_differences_are_joined(get_keys):
+    keys = get_keys(['Deep learning for the detection of diabetic retinopathy', 'Deep-learning for the detection of diabetic retinopathy.', 'Deep learning for the detection of diabetic retinopaty'])
+    assert len(set(keys.values())) == 1, keys
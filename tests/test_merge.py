@@ -0,0 +1,126 @@
+import random
+import zlib
+
+import remove_duplicates as rd
+
+def test_title_duplicate_without_doi(new_orr):
+    # A base record without DOI, found again by title in the next repository
+    orr = new_orr({'Scopus': [{'Title': 'Same title', 'DOI': None}],
+                   'Web of Science': [{'Title': 'Same title', 'DOI': '10.1/c'}]},
+                  check_doi = lambda doi: doi is not None)
+    collect_unique, collect_duplicate = orr.get_sheet_data()
+
+    assert [(item.doi, orr.get_repositories(item.repositories)) for item in collect_unique] == [('10.1/c', 'Scopus/Web of Science')]
+    assert [(item.doi, item.duplicate_type) for item in collect_duplicate] == [(None, orr.xls_val_by_title)]
+
+def fold(exports, check_doi):
+    # The pairwise fold the N-way merge replaced: the base repository merged
+    # with each of the others in turn, checking every repeated title again
+    repositories = list(exports.keys())
+    collection_base = [dict(item, repository = repositories[0]) for item in exports[repositories[0]]]
+    collect_duplicate = []
+    for secondary_repository in repositories[1:]:
+        collection_secondary = [dict(item, repository = secondary_repository) for item in exports[secondary_repository]]
+        dois_base = {item['DOI'] for item in collection_base if item['DOI']}
+        dois_secondary = {item['DOI'] for item in collection_secondary if item['DOI']}
+        dois_duplicate = dois_base & dois_secondary
+        dois_only_secondary = dois_secondary - dois_base
+
+        collect_unique_doi = []
+        for item in collection_base:
+            if item['DOI'] in dois_duplicate:
+                item['repository'] = '%s/%s' % (item['repository'], secondary_repository)
+            collect_unique_doi.append(item)
+        for item in collection_secondary:
+            if item['DOI'] in dois_duplicate:
+                collect_duplicate.append(dict(item, type = 'By DOI'))
+            if item['DOI'] in dois_only_secondary:
+                collect_unique_doi.append(item)
+
+        titles = [item['Title'].lower() for item in collect_unique_doi if item['Title']]
+        re_title = {title for title in titles if titles.count(title) > 1}
+        nr_title_ctrl = {title: {'n_check': 0, 'is_valid': False, 'repository': None} for title in re_title}
+        collect_unique = []
+        for row in collect_unique_doi:
+            title = row['Title'].lower() if row['Title'] else None
+            flag_unique = True
+            if title in re_title:
+                ctrl = nr_title_ctrl[title]
+                status = check_doi(row['DOI']) if not ctrl['is_valid'] else False
+                if status:
+                    ctrl['is_valid'] = True
+                flag_unique = status or (ctrl['n_check'] == 1 and not ctrl['is_valid'])
+                if ctrl['repository'] is None:
+                    ctrl['repository'] = row['repository']
+                if flag_unique:
+                    row['repository'] = '%s/%s' % (ctrl['repository'], secondary_repository)
+                else:
+                    row['repository'] = row['repository'].split('/')[-1]
+                ctrl['n_check'] += 1
+
+            if flag_unique:
+                collect_unique.append(row)
+            else:
+                collect_duplicate.append(dict(row, type = 'By Title'))
+        collection_base = collect_unique
+
+    return collection_base, collect_duplicate
+
+def get_exports(seed):
+    # Repositories sharing DOIs and titles, some titles repeated with other DOIs
+    rnd = random.Random(seed)
+    titles = ['Title %s' % i for i in range(rnd.randint(5, 30))]
+    works = [('10.%s/%s' % (seed, i), rnd.choice(titles)) for i in range(rnd.randint(10, 60))]
+    exports = {}
+    for repository in ['Scopus', 'Web of Science', 'PubMed', 'Dimensions'][:rnd.randint(2, 4)]:
+        records = []
+        for doi, title in rnd.sample(works, rnd.randint(1, len(works))):
+            if not exports and rnd.random() < 0.1:
+                doi = None # Only kept in the base repository
+            records.append({'Title': title, 'DOI': doi})
+        exports.update({repository: records})
+
+    return exports
+
+def test_merge_matches_pairwise_fold(new_orr):
+    for seed in range(60):
+        exports = get_exports(seed)
+        is_valid = lambda doi: doi is not None and zlib.crc32(doi.encode()) % 3 != 0
+
+        fold_calls = []
+        fold_unique, fold_duplicate = fold(exports, lambda doi: fold_calls.append(doi) or is_valid(doi))
+
+        merge_calls = []
+        orr = new_orr(exports, check_doi = lambda doi: merge_calls.append(doi) or is_valid(doi))
+        collections = {repository: orr.xls_sheets[repository][orr.XLS_SHEET_UNIQUE] for repository in exports}
+        merge_unique, merge_duplicate = orr.merge_collections(collections)
+
+        # A repository reaching a record twice is listed once since the bitmask
+        repositories = lambda item: '/'.join(dict.fromkeys(item['repository'].split('/')))
+        assert [(item.title, item.doi, orr.get_repositories(item.repositories)) for item in merge_unique] == \
+               [(item['Title'], item['DOI'], repositories(item)) for item in fold_unique], seed
+        assert [(item.title, item.doi, orr.get_repositories(item.repositories), item.duplicate_type) for item in merge_duplicate] == \
+               [(item['Title'], item['DOI'], repositories(item), item['type']) for item in fold_duplicate], seed
+        # The same lookups, the merge goes group by group instead of row by row
+        assert sorted(merge_calls, key = str) == sorted(fold_calls, key = str), seed
+
+class UnavailableCrossref:
+    def works(self, dois, fields = None, stats = None, deadline = None):
+        raise rd.CrossrefUnavailable('works')
+
+    def work(self, doi, stats = None, deadline = None):
+        raise rd.CrossrefUnavailable('work')
+
+    def close(self):
+        pass
+
+def test_title_group_kept_when_crossref_is_unavailable(new_orr):
+    # No record becomes a 'By Title' duplicate without its DOI checked
+    orr = new_orr({'Scopus': [{'Title': 'Same title', 'DOI': '10.1/a'}],
+                   'Web of Science': [{'Title': 'Same title', 'DOI': '10.1/b'}, {'Title': 'Same title', 'DOI': '10.1/c'}]})
+    orr.crossref_client = UnavailableCrossref()
+    collect_unique, collect_duplicate = orr.get_sheet_data()
+
+    assert [item.doi for item in collect_unique] == ['10.1/a', '10.1/b', '10.1/c']
+    assert collect_duplicate == []
+    assert orr.crossref_unverified == {'10.1/a', '10.1/b', '10.1/c'}
@@ -0,0 +1,30 @@
+import tracemalloc
+
+def test_stage_peak_memory_is_per_stage(new_orr):
+    # A large allocation in a first stage isn't the peak of the next one, and
+    # the peak of a nested stage is also the peak of the stage around it
+    orr = new_orr()
+    tracemalloc.start()
+    try:
+        with orr.stage('first'):
+            data = bytearray(20 * 2**20)
+            del data
+        with orr.stage('second'):
+            with orr.stage('nested'):
+                data = bytearray(10 * 2**20)
+                del data
+    finally:
+        tracemalloc.stop()
+
+    stages = orr.metrics['stages']
+    assert stages['first']['peak_memory_mb'] >= 20
+    assert 10 <= stages['nested']['peak_memory_mb'] < 20
+    assert 10 <= stages['second']['peak_memory_mb'] < 20
+    assert orr.stage_peaks == []
+
+def test_stage_peak_memory_without_tracing(new_orr):
+    orr = new_orr()
+    with orr.stage('first'):
+        pass
+
+    assert orr.metrics['stages']['first']['peak_memory_mb'] is None
@@ -0,0 +1,94 @@
+import os
+import csv
+import json
+import sqlite3
+
+import pandas as pd
+import pytest
+
+EXPORTS = {'Scopus': {'Unique': [{'Title': 'First', 'DOI': '10.1/a', 'Year': 2020},
+                                 {'Title': 'Second', 'DOI': '10.1/b', 'Year': 2021}],
+                      'Without DOI': [{'Title': 'Third', 'DOI': None}]},
+           'Web of Science': {'Unique': [{'Title': 'First', 'DOI': '10.1/a'},
+                                         {'Title': 'Fourth', 'DOI': '10.1/d'}],
+                              'Duplicates': [{'Title': 'Fifth', 'DOI': '10.1/e', 'Duplicate Type': 'By DOI'}]}}
+
+def read_csv(files, delimiter):
+    sheets = {}
+    for file in files:
+        with open(file, encoding = 'utf-8', newline = '') as f:
+            rows = list(csv.reader(f, delimiter = delimiter))
+        sheets.update({file: (rows[0], len(rows) - 1)})
+    return sheets
+
+def read_jsonl(files):
+    sheets = {}
+    for file in files:
+        with open(file, encoding = 'utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        sheets.update({file: (list(rows[0].keys()), len(rows))})
+    return sheets
+
+def read_parquet(files):
+    return {file: (list(df.columns), len(df)) for file, df in [(file, pd.read_parquet(file)) for file in files]}
+
+@pytest.fixture
+def summary(new_orr, tmp_path):
+    # Writes the merge of EXPORTS in the given format, returns the files and
+    # the columns and number of rows expected in each sheet
+    def write(output_format):
+        orr = new_orr(EXPORTS)
+        orr.OUTPUT_FORMATS = [output_format]
+        orr.XLS_FILE_OUTPUT = str(tmp_path / 'summary_screened.xlsx')
+        collect_unique, collect_duplicate = orr.get_sheet_data()
+        collect_without_doi, collect_duplicates = orr.get_sheet_data_complement(collect_duplicate)
+        files = orr.save_summary(collect_unique, collect_without_doi, collect_duplicates)
+        expected = {orr.SHEET_NAMES[sheet]: (orr.get_sheet_columns(sheet), len(records)) for sheet, records in [(orr.XLS_SHEET_UNIQUE, collect_unique),
+                                                                                                               (orr.XLS_SHEET_WITHOUT_DOI, collect_without_doi),
+                                                                                                               (orr.XLS_SHEET_DUPLICATES, collect_duplicates)]}
+        return orr, files, expected
+    return write
+
+def get_sheet_name(file):
+    # summary_screened_without_doi.csv -> without_doi
+    return os.path.splitext(os.path.basename(file))[0][len('summary_screened_'):]
+
+@pytest.mark.parametrize('output_format', ['csv', 'tsv', 'jsonl', 'parquet'])
+def test_one_file_per_sheet(summary, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    orr, files, expected = summary(output_format)
+
+    assert [os.path.basename(file) for file in files] == ['summary_screened_%s.%s' % (name, output_format) for name in expected]
+    if output_format in ['csv', 'tsv']:
+        sheets = read_csv(files, '\t' if output_format == 'tsv' else ',')
+    elif output_format == 'jsonl':
+        sheets = read_jsonl(files)
+    else:
+        sheets = read_parquet(files)
+    assert {get_sheet_name(file): sheet for file, sheet in sheets.items()} == expected
+    assert expected == {'unique': (orr.get_sheet_columns(orr.XLS_SHEET_UNIQUE), 3),
+                        'without_doi': (orr.get_sheet_columns(orr.XLS_SHEET_WITHOUT_DOI), 1),
+                        'duplicates': (orr.get_sheet_columns(orr.XLS_SHEET_DUPLICATES), 2)}
+
+def test_xlsx(summary):
+    orr, files, expected = summary('xlsx')
+    sheets = pd.read_excel(files[0], sheet_name = None)
+
+    assert {orr.SHEET_NAMES[sheet]: (list(df.columns), len(df)) for sheet, df in sheets.items()} == expected
+
+def test_sqlite(summary):
+    orr, files, expected = summary('sqlite')
+    connection = sqlite3.connect(files[0])
+    tables = [name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY rowid")]
+    indexes = sorted([name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")])
+    sheets = {}
+    for table in tables:
+        columns = [row[1] for row in connection.execute('PRAGMA table_info("%s")' % table)]
+        sheets.update({table: (columns, connection.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0])})
+    connection.close()
+
+    assert os.path.basename(files[0]) == 'summary_screened.sqlite'
+    assert tables == ['unique', 'without_doi', 'duplicates']
+    assert sheets == expected
+    assert indexes == sorted(['%s_%s' % (table, column) for table in tables for column in ['doi', 'title']])
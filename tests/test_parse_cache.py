@@ -0,0 +1,77 @@
+import os
+
+import pytest
+import xlsxwriter
+
+import remove_duplicates as rd
+
+@pytest.fixture
+def parse_orr(new_orr, tmp_path, monkeypatch):
+    # Counts the workbooks actually parsed
+    orr = new_orr()
+    orr.PARSE_CACHE_PATH = str(tmp_path / 'parse_cache')
+    orr.parsed = []
+    read_excel = rd.pd.read_excel
+    def counted_read_excel(io, **kwargs):
+        orr.parsed.append(io)
+        return read_excel(io, **kwargs)
+    monkeypatch.setattr(rd.pd, 'read_excel', counted_read_excel)
+    return orr
+
+def write_workbook(orr, path, rows):
+    # A formatted export with the given 'Unique' rows and empty other sheets
+    columns = [column for column in orr.xls_columns if column != orr.xls_col_repository]
+    workbook = xlsxwriter.Workbook(str(path))
+    for sheet, sheet_rows, sheet_columns in [(orr.XLS_SHEET_UNIQUE, rows, columns),
+                                             (orr.XLS_SHEET_WITHOUT_DOI, [], columns),
+                                             (orr.XLS_SHEET_DUPLICATES, [], columns + [orr.xls_col_duplicate_type])]:
+        worksheet = workbook.add_worksheet(sheet)
+        worksheet.write_row(0, 0, sheet_columns)
+        for irow, row in enumerate(sheet_rows, start = 1):
+            worksheet.write_row(irow, 0, [irow] + [row.get(column) for column in sheet_columns[1:]])
+    workbook.close()
+
+def get_rows(n, year = 2020):
+    return [{'Title': 'Title %s' % i, 'DOI': '10.1/%s' % i, 'Year': year + i, 'Cited By': i} for i in range(n)]
+
+def get_cache_files(orr):
+    return sorted(os.listdir(orr.PARSE_CACHE_PATH))
+
+def test_unchanged_workbook_is_read_from_the_cache(parse_orr, tmp_path):
+    pytest.importorskip('pyarrow')
+    file = tmp_path / 'input_scopus.xlsx'
+    write_workbook(parse_orr, file, get_rows(5))
+    parsed = parse_orr.read_xls_file(str(file))
+    cached = parse_orr.read_xls_file(str(file))
+
+    assert parse_orr.parsed == [str(file)]
+    assert cached == parsed
+    assert all(name.endswith('.arrow') for name in get_cache_files(parse_orr))
+
+def test_changed_workbook_is_parsed_again(parse_orr, tmp_path):
+    file = tmp_path / 'input_scopus.xlsx'
+    write_workbook(parse_orr, file, get_rows(5))
+    parse_orr.read_xls_file(str(file))
+    write_workbook(parse_orr, file, get_rows(6))
+    changed = parse_orr.read_xls_file(str(file))
+
+    assert parse_orr.parsed == [str(file), str(file)]
+    assert len(changed[parse_orr.XLS_SHEET_UNIQUE]) == 6
+    # One set of files per content
+    assert len(get_cache_files(parse_orr)) == 6
+
+def test_mixed_column_falls_back_to_pickle(parse_orr, tmp_path):
+    # Years as numbers and as text in the same column, Arrow can't store it
+    pytest.importorskip('pyarrow')
+    file = tmp_path / 'input_scopus.xlsx'
+    rows = get_rows(3)
+    rows[1].update({'Year': 'In press'})
+    write_workbook(parse_orr, file, rows)
+    parsed = parse_orr.read_xls_file(str(file))
+    cached = parse_orr.read_xls_file(str(file))
+
+    assert parse_orr.parsed == [str(file)]
+    assert cached == parsed
+    assert [item[2] for item in cached[parse_orr.XLS_SHEET_UNIQUE]] == [2020, 'In press', 2022]
+    names = get_cache_files(parse_orr)
+    assert [name for name in names if name.endswith('.pkl')] == [name for name in names if '_unique_' in name]
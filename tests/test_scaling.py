@@ -0,0 +1,62 @@
+import gc
+import time
+
+import remove_duplicates as rd
+
+SIZES = [10000, 20000, 40000]
+
+def get_records(n, offset = 0):
+    # Half of the DOIs of a repository are also in the next one
+    return [rd.Record('Title %s' % i, None, None, '10.1/%s' % i, None, None, None, None, 'title %s' % i, '10.1/%s' % i) for i in range(offset, offset + n)]
+
+def get_time(setup, function, number, repeat = 5):
+    # Best of a few runs of number calls, setup() returns the arguments of
+    # function. Without the garbage collector, its passes grow with the
+    # objects alive
+    best = None
+    for _ in range(repeat):
+        args = [setup() for _ in range(number)]
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for arg in args:
+                function(*arg)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def assert_linear(get_setup, function, attempts = 3):
+    # The same number of records at every size: about the same time if
+    # linear, 4x from the smallest to the largest size if quadratic. Timing
+    # noise rarely repeats, a quadratic join fails every attempt
+    for _ in range(attempts):
+        times = [get_time(get_setup(n), function, SIZES[-1] // n) for n in SIZES]
+        ratio = times[-1] / times[0]
+        if ratio < 3:
+            return
+    assert ratio < 3, 'time per record x%.1f from %s to %s records: %s' % (ratio, SIZES[0], SIZES[-1], times)
+
+def test_index_dois_is_linear(new_orr):
+    orr = new_orr()
+
+    def get_setup(n):
+        collection = dict(enumerate(get_records(n), start = 1))
+        return lambda: (collection,)
+
+    assert_linear(get_setup, orr.index_dois)
+
+def test_join_dois_is_linear(new_orr):
+    orr = new_orr()
+
+    def get_setup(n):
+        def setup():
+            state = orr.new_merge_state()
+            orr.merge_repository(state, orr.REPOSITORY_SCOPUS, get_records(n))
+            state['files'].append((orr.REPOSITORY_SCOPUS, None))
+            return state, orr.REPOSITORY_WOS, get_records(n, offset = n // 2)
+        return setup
+
+    assert_linear(get_setup, orr.join_dois)
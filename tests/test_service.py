@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+import threading
+import subprocess
+
+import pytest
+import remove_duplicates as rd
+
+@pytest.fixture
+def service(new_orr):
+    orr = new_orr()
+    service = rd.DedupService(orr, port = 0)
+    yield service
+    service.server.server_close()
+
+def test_job_gets_only_its_own_files(service, tmp_path):
+    # The service started with -f: its files are not added to the jobs
+    service.orr.set_input_file(os.path.join('service', service.orr.NAME_XLS_FILE_SCOPUS))
+    job = {'id': 'job', 'files': [str(tmp_path / service.orr.NAME_XLS_FILE_WOS)], 'output': str(tmp_path), 'options': {}}
+    orr = service.get_job_orr(job)
+    orr.get_list_files()
+
+    assert list(orr.DICT_XLS_FILES.keys()) == [orr.REPOSITORY_WOS]
+
+class JobRecorder(dict):
+    # The keys in the order they are set
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.keys_set = []
+
+    def update(self, values):
+        self.keys_set.extend(values.keys())
+        super().update(values)
+
+class FinishedRun:
+    LOG_FILE = 'log'
+    METRICS_FILE = 'metrics'
+    checkpoint_file = None
+
+    def __init__(self):
+        self.metrics = {}
+
+    def run(self):
+        return ['summary_screened.xlsx'], {'unique': 1, 'duplicates': 0, 'without_doi': 0}
+
+    def save_metrics(self, status, counts = None):
+        pass
+
+def test_job_status_is_set_last(service):
+    # A client reads the job as soon as it's done
+    service.get_job_orr = lambda job: FinishedRun()
+    job = JobRecorder({'id': 'job', 'status': 'queued'})
+    service.run_job(job)
+
+    assert job['status'] == 'done'
+    assert job.keys_set[-1] == 'status'
+    assert job.keys_set.index('elapsed_seconds') < len(job.keys_set) - 1
+
+def test_jobs_count_their_own_crossref_requests(service, crossref, tmp_path):
+    # Two jobs at the same time on the Crossref client of the service
+    mock = crossref(latency = 0.05)
+    service.orr.crossref_client = rd.CrossrefClient(mock.url)
+    orrs = [service.get_job_orr({'id': str(i), 'files': [], 'output': str(tmp_path / str(i)), 'options': {}}) for i in range(2)]
+
+    def run(orr, dois):
+        with orr.stage('title_resolution'):
+            for doi in dois:
+                orr.check_doi(doi)
+
+    threads = [threading.Thread(target = run, args = (orrs[0], ['10.1/a%s' % i for i in range(3)])),
+               threading.Thread(target = run, args = (orrs[1], ['10.1/b%s' % i for i in range(5)]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [orr.metrics['stages']['title_resolution']['crossref']['requests'] for orr in orrs] == [3, 5]
+    assert service.orr.crossref_client.stats['requests'] == 8
+    service.orr.crossref_client.close()
+
+def test_job_parses_without_forking_the_service(service, write_exports, tmp_path):
+    files = write_exports(tmp_path / 'input', size = 20, repositories = 2)
+    orr = service.get_job_orr({'id': 'job', 'files': files, 'output': str(tmp_path / 'output'), 'options': {}})
+    orr.JOBS = 2
+    orr.PARSE_CACHE_PATH = None
+    orr.get_list_files()
+    thread = threading.Thread(target = orr.load_xls_files)
+    thread.start()
+    thread.join()
+
+    assert orr.MP_START_METHOD in ['forkserver', 'spawn']
+    assert [len(orr.xls_sheets[repository][orr.XLS_SHEET_UNIQUE]) for repository in orr.DICT_XLS_FILES] == [20, 20]
+
+def test_serve_address(new_orr):
+    orr = new_orr()
+    assert orr.get_serve_address('localhost') == ('localhost', orr.SERVE_PORT)
+    assert orr.get_serve_address('9000') == (orr.SERVE_HOST, 9000)
+    assert orr.get_serve_address('0.0.0.0:9000') == ('0.0.0.0', 9000)
+    assert orr.get_serve_address(':9000') == (orr.SERVE_HOST, 9000)
+    for address in ['', ':', 'localhost:', 'localhost:port', '70000']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            orr.get_serve_address(address)
+
+def test_bad_serve_address_is_a_usage_error():
+    process = subprocess.run([sys.executable, rd.__file__, '--serve', 'localhost:port'], capture_output = True, text = True)
+
+    assert process.returncode == 2
+    assert "argument --serve: invalid address 'localhost:port'" in process.stderr
+    assert 'Traceback' not in process.stderr
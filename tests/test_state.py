@@ -0,0 +1,33 @@
+import shutil
+
+def assert_same_sheets(sheets, expected):
+    assert list(sheets.keys()) == list(expected.keys())
+    for name, df in expected.items():
+        assert sheets[name].equals(df), name
+
+def test_state_run_matches_one_shot_run(tmp_path, crossref, write_exports, run_cli):
+    # The third repository merged into the saved index of the first two
+    files = write_exports(tmp_path / 'input')
+    mock = crossref()
+    state = str(tmp_path / 'project.state')
+    _, one_shot = run_cli(files, tmp_path / 'one_shot', '--crossref-url', mock.url)
+
+    run_cli(files[:2], tmp_path / 'incremental', '--crossref-url', mock.url, '--state', state)
+    output, incremental = run_cli(files, tmp_path / 'incremental', '--crossref-url', mock.url, '--state', state)
+
+    assert 'Dedup index: 2 repositories already merged, 1 new' in output
+    assert_same_sheets(incremental, one_shot)
+
+def test_state_with_an_updated_file_merges_all_again(tmp_path, crossref, write_exports, run_cli):
+    files = write_exports(tmp_path / 'input')
+    updated = write_exports(tmp_path / 'updated', seed = 2)
+    mock = crossref()
+    state = str(tmp_path / 'project.state')
+    run_cli(files, tmp_path / 'incremental', '--crossref-url', mock.url, '--state', state)
+
+    shutil.copy(updated[1], files[1])
+    output, incremental = run_cli(files, tmp_path / 'incremental', '--crossref-url', mock.url, '--state', state)
+    _, one_shot = run_cli(files, tmp_path / 'one_shot', '--crossref-url', mock.url)
+
+    assert 'Files updated or removed since the dedup index was saved: Web of Science, merging all the files again' in output
+    assert_same_sheets(incremental, one_shot)